@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+fake_server.py  –  pure-Python stand-in for source_code/server
+
+Serves the same API (`GET /` and `GET /:group/:id`, HTTP/1.1 keep-alive with
+pipelining, same response headers) over generated charms, so the pipeline can
+run where the aarch64 server cannot:
+
+    python fake_server.py --groups 8 --group-size 50000 &
+    cd source_code && python main.py
+
+The data is a pure function of the options, so the hash of a run is
+reproducible. uvloop is used when installed.
+"""
+
+import argparse, asyncio, json, random
+
+def charm_len(rnd: random.Random, args) -> int:
+    if args.sizes == "uniform":
+        return rnd.randint(args.min_len, args.max_len)
+    # exponential above the minimum: mostly short charms, a few long ones
+    return min(args.max_len, args.min_len + int(rnd.expovariate(1 / max(1, args.mean_len - args.min_len))))
+
+def tail_run(rnd: random.Random, content: bytearray):
+    """end the content with a run of one repeated base64 symbol, for higher levels"""
+    s = rnd.randrange(64)
+    pattern = bytes([s << 2 | s >> 4, (s & 15) << 4 | s >> 2, (s & 3) << 6 | s])
+    for p in range(len(content) - rnd.randint(1, 14), len(content)):
+        content[p] = pattern[p % 3]
+
+def near_dup(rnd: random.Random, earlier: bytes) -> bytearray:
+    """a copy of `earlier` differing in up to 2 bytes before its last 16, same checksum"""
+    content = bytearray(earlier)
+    head = len(content) - 16
+    if rnd.random() < 0.8 and head >= 2:
+        a, b = rnd.sample(range(head), 2)
+        d = rnd.randrange(1, 256)
+        content[a] ^= d
+        content[b] ^= d
+    return content
+
+def checksum(content: bytes) -> int:
+    """xor of the content bytes, folding its halves together as one big int"""
+    x, n = int.from_bytes(content, "little"), len(content)
+    while n > 1:
+        n = (n + 1) // 2
+        x = x >> 8 * n ^ x & ((1 << 8 * n) - 1)
+    return x
+
+def generate_group(args, group_id: int) -> list[bytes]:
+    """charms of one group: content followed by price (xor of content bytes)"""
+    rnd = random.Random(f"{args.seed}/{group_id}")
+    charms = []
+    for _ in range(args.group_size):
+        if charms and rnd.random() < args.dup_ratio:
+            content = near_dup(rnd, rnd.choice(charms)[:-1])
+        else:
+            content = bytearray(rnd.randbytes(charm_len(rnd, args)))
+            if rnd.random() < args.tail_ratio:
+                tail_run(rnd, content)
+        price = checksum(content)
+        if rnd.random() < args.invalid_ratio:
+            price ^= rnd.randrange(1, 256)
+        charms.append(bytes(content) + bytes([price]))
+    return charms
+
+def response(body: bytes, content_type: bytes = b"application/octet-stream", status: bytes = b"200 OK") -> bytes:
+    return (b"HTTP/1.1 " + status + b"\r\nConnection: Keep-Alive\r\nContent-Type: " + content_type +
+            b"\r\nContent-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+
+NOT_FOUND = response(b"not found", b"text/plain", b"404 Not Found")
+
+class Server:
+    def __init__(self, args):
+        groups = [generate_group(args, g) for g in range(args.groups)]
+        self.meta = response(json.dumps([len(g) for g in groups]).encode(), b"application/json")
+        self.responses = [[response(charm) for charm in g] for g in groups]
+
+    def respond(self, path: bytes) -> bytes:
+        if path == b"/":
+            return self.meta
+        try:
+            _, group, index = path.split(b"/")
+            return self.responses[int(group)][int(index)]
+        except (ValueError, IndexError):
+            return NOT_FOUND
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                # "GET /path HTTP/1.1" or, as fastreq sends it, just "GET /path"
+                path = head.split(b"\r\n", 1)[0].split(b" ")[1]
+                writer.write(self.respond(path))
+                # pipelined requests keep being answered until the socket backs up
+                if writer.transport.get_write_buffer_size() > 1 << 20:
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+async def serve_forever(args):
+    server = Server(args)
+    listener = await asyncio.start_server(server.serve, args.host, args.port)
+    print(f"Serving {args.groups} x {args.group_size} charms on {args.host}:{args.port}", flush=True)
+    async with listener:
+        await listener.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="stand-in m4c charm server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--groups", type=int, default=4)
+    parser.add_argument("--group-size", type=int, default=20000)
+    parser.add_argument("--sizes", choices=["exp", "uniform"], default="exp",
+                        help="content length distribution within [--min-len, --max-len]")
+    parser.add_argument("--min-len", type=int, default=32)
+    parser.add_argument("--max-len", type=int, default=16384)
+    parser.add_argument("--mean-len", type=int, default=1024, help="mean content length for --sizes exp")
+    parser.add_argument("--invalid-ratio", type=float, default=0.2, help="share of charms with a wrong price")
+    parser.add_argument("--dup-ratio", type=float, default=0.1, help="share of near-duplicates of earlier charms")
+    parser.add_argument("--tail-ratio", type=float, default=0.3, help="share of charms ending in a run of one symbol")
+    args = parser.parse_args()
+    if not 16 <= args.min_len <= args.max_len:
+        parser.error("need 16 <= --min-len <= --max-len")
+
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    asyncio.run(serve_forever(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+'''
+Per-stage timings of the m4c pipeline, against a server already listening on
+main.REMOTE_PORT:
+
+    python bench.py [-o bench.json] [-g GROUPS]
+
+Groups are run one after another (downloads still prefetch as in main.py), so
+the stages of a group do not overlap with those of another. "download" is the
+time spent waiting for a group's responses, "checksum" includes dividing by
+price. Settings come from the same M4C_* variables as main.py; the report has
+the connections and depth the client used, as tuned with M4C_AUTOTUNE=1, or
+null when every group came from the charm cache.
+'''
+import argparse, hashlib, json, resource, time
+import main
+from main import fastreq
+
+STAGES = ["download", "checksum", "dedup", "level", "hash"]
+
+class Stopwatch:
+    '''seconds between consecutive laps, by stage'''
+    def __init__(self):
+        self.times = {}
+        self.last = time.perf_counter()
+
+    def lap(self, stage: str):
+        now = time.perf_counter()
+        self.times[stage] = now - self.last
+        self.last = now
+
+def bench(groups: list[int]) -> dict:
+    sha1 = hashlib.sha1()
+    runs = []
+    start = time.perf_counter()
+    for group_id, charms in main.download_groups(groups):
+        watch = Stopwatch()
+        result = main.run_group(group_id, charms, watch.lap)
+        for charm in result:
+            sha1.update(charm[:-1])
+        watch.lap("hash")
+        runs.append({"group": group_id, "size": groups[group_id], "kept": len(result), **watch.times})
+    total = time.perf_counter() - start
+    connections, depth = main.connected or (None, None)
+    return {
+        "settings": {"connections": connections, "depth": depth,
+                     "threads": main.THREADS, "autotune": main.AUTOTUNE},
+        "groups": runs,
+        "stages": {stage: sum(run[stage] for run in runs) for stage in STAGES},
+        "total": total,
+        "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "sha1": sha1.hexdigest(),
+    }
+
+def cli():
+    parser = argparse.ArgumentParser(description="time each stage of the m4c pipeline")
+    parser.add_argument("-o", "--output", default="bench.json", help="where to write the JSON report")
+    parser.add_argument("-g", "--groups", type=int, help="only run the first GROUPS groups")
+    args = parser.parse_args()
+
+    main.wait_for_server(main.REMOTE_PORT)
+    groups = json.loads(fastreq.get(["/"], main.REMOTE_PORT, connections=1, depth=1)[0])
+    report = bench(groups[:args.groups])
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    for stage, seconds in report["stages"].items():
+        print(f"{stage:>9}: {seconds:.3f}s")
+    print(f"    total: {report['total']:.3f}s, peak RSS {report['peak_rss_kib'] / 1024:.1f} MiB")
+
+if __name__ == "__main__":
+    cli()
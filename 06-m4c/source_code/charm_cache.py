@@ -0,0 +1,96 @@
+'''
+On-disk cache of downloaded groups, to iterate on the filters without paying for
+the network (and to time a warm-cache lower bound):
+
+    M4C_CACHE=/tmp/m4c-cache python main.py
+
+Each group is stored as <group id>-<group size>.charms: the charm count n, then
+n+1 offsets, then the charms back to back (uint64s in native byte order), and is
+mapped back in with mmap. M4C_CACHE_MODE picks how the cache is used:
+
+    use       read the groups that are cached, download and store the rest (default)
+    validate  download every group anyway, report where the cache differs, store it
+    bypass    neither read nor write the cache
+'''
+import mmap, os, struct
+
+CACHE_DIR = os.environ.get("M4C_CACHE")
+CACHE_MODE = os.environ.get("M4C_CACHE_MODE", "use")
+if CACHE_MODE not in ("use", "validate", "bypass"):
+    raise ValueError(f"M4C_CACHE_MODE must be use, validate or bypass, not {CACHE_MODE!r}")
+
+U64 = struct.Struct("=Q")
+
+def cache_path(group_id: int, group_size: int) -> str:
+    return os.path.join(CACHE_DIR, f"{group_id}-{group_size}.charms")
+
+class Cached:
+    '''a cached group, read like the fastreq.Stream it was stored from'''
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            # an empty file cannot be mapped at all
+            if os.fstat(f.fileno()).st_size < U64.size:
+                raise ValueError(self.truncated())
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size, = U64.unpack_from(self.map)
+
+    def truncated(self) -> str:
+        return f"{self.path} is truncated, delete it or run with M4C_CACHE_MODE=validate"
+
+    def __len__(self) -> int:
+        return self.size
+
+    def arena(self) -> tuple[memoryview, memoryview]:
+        '''(data, offsets) as fastreq.Stream.arena; views into the mapping'''
+        view = memoryview(self.map)
+        start = U64.size * (self.size + 2)
+        if len(view) < start or len(view) != start + U64.unpack_from(view, start - U64.size)[0]:
+            raise ValueError(self.truncated())
+        return view[start:], view[U64.size:start].cast("Q")
+
+def write(path: str, data: memoryview, offsets: memoryview):
+    # write aside and rename, so an interrupted run never leaves a torn group
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(U64.pack(len(offsets) - 1))
+        f.write(offsets)
+        f.write(data)
+    os.replace(tmp, path)
+
+class Storing:
+    '''a group being downloaded, stored to the cache once it has arrived'''
+    def __init__(self, charms, path: str):
+        self.charms = charms
+        self.path = path
+
+    def __len__(self) -> int:
+        return len(self.charms)
+
+    def matches(self, data: memoryview, offsets: memoryview) -> bool:
+        try:
+            cached_data, cached_offsets = Cached(self.path).arena()
+        except ValueError:
+            return False
+        return cached_offsets == offsets and cached_data == data
+
+    def arena(self) -> tuple[memoryview, memoryview]:
+        data, offsets = self.charms.arena()
+        if CACHE_MODE == "validate" and os.path.exists(self.path) and not self.matches(data, offsets):
+            print(f"Cache of {os.path.basename(self.path)} differs from the server, replacing it")
+        write(self.path, data, offsets)
+        return data, offsets
+
+def load(group_id: int, group_size: int) -> Cached | None:
+    '''the cached group, if there is one and the cache may be read'''
+    if CACHE_DIR is None or CACHE_MODE != "use":
+        return None
+    path = cache_path(group_id, group_size)
+    return Cached(path) if os.path.exists(path) else None
+
+def store(group_id: int, group_size: int, charms):
+    '''wrap a fastreq.Stream of the group so its charms get cached, if the cache may be written'''
+    if CACHE_DIR is None or CACHE_MODE == "bypass":
+        return charms
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return Storing(charms, cache_path(group_id, group_size))
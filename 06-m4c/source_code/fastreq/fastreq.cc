@@ -4,155 +4,651 @@
 #include <string>
 #include <vector>
 #include "src/fastreq"
+#include "src/charm"
 
-// Python bytes
-class PyBytes {
-private:
-    PyObject* py_bytes_;
-    buf_mut span_;
-
-public:
-    PyBytes(): py_bytes_(nullptr) {}
-    // Constructor that creates uninitialized bytes of given length
-    explicit PyBytes(size_t length) {
-        py_bytes_ = PyBytes_FromStringAndSize(nullptr, length);
-        if (!py_bytes_) {
-            throw std::runtime_error("Failed to create PyBytes object");
-        }
-        char* data = PyBytes_AS_STRING(py_bytes_);
-        span_ = buf_mut(reinterpret_cast<std::byte*>(data), length);
+// responses are carved out of per-thread chunks, see ArenaBuf
+using Charm = ArenaBuf;
+using DownloadClient = Client<Charm>;
+
+// Converts a batch of responses to its Python form; returns nullptr with a Python error set.
+using Convert = PyObject* (*)(span<const Charm>);
+
+static PyObject* to_pybytes(const Charm& charm) {
+    buf data = charm.span();
+    return PyBytes_FromStringAndSize(reinterpret_cast<const char*>(data.data()), data.size());
+}
+
+// Copy responses into a new Python list of bytes.
+static PyObject* to_pylist(span<const Charm> results) {
+    PyObject* result_list = PyList_New(results.size());
+    if (!result_list) {
+        return nullptr;
     }
     
-    // Constructor from existing PyObject*
-    explicit PyBytes(PyObject* obj) : py_bytes_(obj) {
-        if (!PyBytes_Check(obj)) {
-            throw std::runtime_error("Object is not a PyBytes");
+    for (size_t i = 0; i < results.size(); ++i) {
+        PyObject* bytes_obj = to_pybytes(results[i]);
+        if (!bytes_obj) {
+            Py_DECREF(result_list);
+            return nullptr;
         }
-        char* data = PyBytes_AS_STRING(obj);
-        Py_ssize_t size = PyBytes_GET_SIZE(obj);
-        span_ = buf_mut(reinterpret_cast<std::byte*>(data), size);
+        PyList_SET_ITEM(result_list, i, bytes_obj);
+    }
+    return result_list;
+}
+
+// Memoryview of `bytes_obj` cast to `format` (e.g. "Q"); steals the reference.
+static PyObject* cast_view(PyObject* bytes_obj, const char* format) {
+    if (!bytes_obj) {
+        return nullptr;
+    }
+    PyObject* raw = PyMemoryView_FromObject(bytes_obj);
+    Py_DECREF(bytes_obj);
+    if (!raw) {
+        return nullptr;
+    }
+    PyObject* view = PyObject_CallMethod(raw, "cast", "s", format);
+    Py_DECREF(raw);
+    return view;
+}
+
+// Copy an array into a new memoryview of the matching format.
+template<class T>
+static PyObject* to_view(const vector<T>& values, const char* format) {
+    return cast_view(PyBytes_FromStringAndSize(reinterpret_cast<const char*>(values.data()),
+                                               values.size() * sizeof(T)), format);
+}
+
+// Pack responses back to back, in url order, into one bytes object. Returns
+// (memoryview of the bodies, memoryview of len+1 uint64 offsets): response i
+// is data[offsets[i]:offsets[i+1]].
+static PyObject* to_arena(span<const Charm> results) {
+    size_t total = 0;
+    for (const auto& charm : results) {
+        total += charm.span().size();
     }
     
-    // Destructor
-    ~PyBytes() {
-        Py_XDECREF(py_bytes_);
+    PyObject* data = PyBytes_FromStringAndSize(nullptr, total);
+    if (!data) {
+        return nullptr;
+    }
+    PyObject* offsets = PyBytes_FromStringAndSize(nullptr, (results.size() + 1) * sizeof(uint64_t));
+    if (!offsets) {
+        Py_DECREF(data);
+        return nullptr;
     }
     
-    // Move constructor
-    PyBytes(PyBytes&& other) noexcept : py_bytes_(other.py_bytes_), span_(other.span_) {
-        other.py_bytes_ = nullptr;
-        other.span_ = buf_mut();
+    // nobody else can see the new objects yet
+    byte* dst = reinterpret_cast<byte*>(PyBytes_AS_STRING(data));
+    uint64_t* off = reinterpret_cast<uint64_t*>(PyBytes_AS_STRING(offsets));
+    Py_BEGIN_ALLOW_THREADS
+    size_t pos = 0;
+    for (size_t i = 0; i < results.size(); ++i) {
+        buf charm = results[i].span();
+        off[i] = pos;
+        std::memcpy(dst + pos, charm.data(), charm.size());
+        pos += charm.size();
     }
+    off[results.size()] = pos;
+    Py_END_ALLOW_THREADS
     
-    // Move assignment
-    PyBytes& operator=(PyBytes&& other) noexcept {
-        if (this != &other) {
-            Py_XDECREF(py_bytes_);
-            py_bytes_ = other.py_bytes_;
-            span_ = other.span_;
-            other.py_bytes_ = nullptr;
-            other.span_ = buf_mut();
+    PyObject* data_view = PyMemoryView_FromObject(data);
+    Py_DECREF(data);
+    PyObject* offsets_view = cast_view(offsets, "Q");
+    if (!data_view || !offsets_view) {
+        Py_XDECREF(data_view);
+        Py_XDECREF(offsets_view);
+        return nullptr;
+    }
+    return Py_BuildValue("(NN)", data_view, offsets_view);
+}
+
+// Convert a Python list of str to C++ strings; returns false with a Python error set.
+static bool parse_urls(PyObject* urls_list, vector<string>& urls) {
+    if (!PyList_Check(urls_list)) {
+        PyErr_SetString(PyExc_TypeError, "urls must be a list of strings");
+        return false;
+    }
+    
+    Py_ssize_t size = PyList_Size(urls_list);
+    urls.reserve(size);
+    
+    for (Py_ssize_t i = 0; i < size; ++i) {
+        PyObject* item = PyList_GetItem(urls_list, i);
+        if (!PyUnicode_Check(item)) {
+            PyErr_SetString(PyExc_TypeError, "all urls must be strings");
+            return false;
+        }
+        
+        Py_ssize_t len;
+        const char* str = PyUnicode_AsUTF8AndSize(item, &len);
+        if (!str) {
+            return false;
         }
-        return *this;
+        urls.emplace_back(str, len);
+    }
+    return true;
+}
+
+// Parse the `connections`, `depth` and `threads` arguments; returns false with a Python error set.
+static bool parse_options(Py_ssize_t connections, Py_ssize_t depth, Py_ssize_t threads, Options& options) {
+    if (connections <= 0 || depth <= 0 || threads <= 0) {
+        PyErr_SetString(PyExc_ValueError, "connections, depth and threads must be positive");
+        return false;
     }
+    options.connections = connections;
+    options.depth = depth;
+    options.threads = threads;
+    return true;
+}
+
+static PyObject* get_as(PyObject* args, PyObject* kwds, Convert convert) {
+    static const char* kwlist[] = {"urls", "remote_port", "connections", "depth", "threads", nullptr};
+    PyObject* urls_list;
+    uint16_t remote_port = 18080;
+    Py_ssize_t connections = Options{}.connections, depth = Options{}.depth, threads = Options{}.threads;
     
-    // Copy constructor and assignment are deleted
-    PyBytes(const PyBytes&) = delete;
-    PyBytes& operator=(const PyBytes&) = delete;
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|Hnnn", const_cast<char**>(kwlist),
+                                     &urls_list, &remote_port, &connections, &depth, &threads)) {
+        return nullptr;
+    }
+    Options options;
+    if (!parse_options(connections, depth, threads, options)) {
+        return nullptr;
+    }
     
-    // Get the underlying PyObject
-    PyObject* pyobject() const { return py_bytes_; }
+    // Convert Python list to C++ vector
+    std::vector<std::string> urls;
+    if (!parse_urls(urls_list, urls)) {
+        return nullptr;
+    }
     
-    // Release ownership of PyObject
-    PyObject* release() {
-        PyObject* temp = py_bytes_;
-        py_bytes_ = nullptr;
-        span_ = buf_mut();
-        return temp;
+    // Call the implementation; the download never touches Python objects
+    vector<Charm> results;
+    std::string error;
+    Py_BEGIN_ALLOW_THREADS
+    try {
+        results = fastreq<Charm>(std::move(urls), remote_port, options);
+    } catch (const std::exception& e) {
+        error = e.what();
+    }
+    Py_END_ALLOW_THREADS
+    if (!error.empty()) {
+        PyErr_SetString(PyExc_RuntimeError, error.c_str());
+        return nullptr;
     }
+    
+    // Convert results to Python objects
+    return convert(results);
+}
+
+static PyObject* m4c_get(PyObject* /*self*/, PyObject* args, PyObject* kwds) {
+    return get_as(args, kwds, to_pylist);
+}
+
+static PyObject* m4c_get_arena(PyObject* /*self*/, PyObject* args, PyObject* kwds) {
+    return get_as(args, kwds, to_arena);
+}
 
-    // implements Buf
+// Python iterator over a batch downloading in the background
+typedef struct {
+    PyObject_HEAD
+    shared_ptr<DownloadClient> client;
+    shared_ptr<Batch<Charm>> batch;
+    size_t next;
+} StreamObject;
 
-    static PyBytes new_(std::size_t len) {
-        return PyBytes(len);
+static void Stream_dealloc(StreamObject* self) {
+    self->batch.~shared_ptr();
+    // the last owner of a client joins its I/O thread, which never needs the GIL
+    Py_BEGIN_ALLOW_THREADS
+    self->client.~shared_ptr();
+    Py_END_ALLOW_THREADS
+    Py_TYPE(self)->tp_free(reinterpret_cast<PyObject*>(self));
+}
+
+static PyObject* Stream_next(StreamObject* self) {
+    Batch<Charm>& batch = *self->batch;
+    if (self->next >= batch.size()) {
+        return nullptr; // StopIteration
     }
     
-    buf span() const noexcept {
-        return span_;
+    Charm charm;
+    std::string error;
+    Py_BEGIN_ALLOW_THREADS
+    try {
+        charm = batch.take(self->next);
+    } catch (const std::exception& e) {
+        error = e.what();
+    }
+    Py_END_ALLOW_THREADS
+    if (!error.empty()) {
+        PyErr_SetString(PyExc_RuntimeError, error.c_str());
+        return nullptr;
     }
     
-    buf_mut span_mut() noexcept {
-        return span_;
+    self->next++;
+    return to_pybytes(charm);
+}
+
+static PyObject* Stream_arena(StreamObject* self, PyObject* /*args*/) {
+    Batch<Charm>& batch = *self->batch;
+    vector<Charm> rest;
+    std::string error;
+    Py_BEGIN_ALLOW_THREADS
+    try {
+        rest.reserve(batch.size() - self->next);
+        for (size_t i = self->next; i < batch.size(); ++i) {
+            rest.push_back(batch.take(i));
+        }
+    } catch (const std::exception& e) {
+        error = e.what();
     }
+    Py_END_ALLOW_THREADS
+    if (!error.empty()) {
+        PyErr_SetString(PyExc_RuntimeError, error.c_str());
+        return nullptr;
+    }
+    
+    self->next = batch.size();
+    return to_arena(rest);
+}
+
+static PyMethodDef StreamMethods[] = {
+    {"arena", reinterpret_cast<PyCFunction>(Stream_arena), METH_NOARGS,
+     "Wait for every response not yielded yet and return them as (data, offsets), as `fastreq.get_arena`."},
+    {NULL, NULL, 0, NULL}
+};
+
+static Py_ssize_t Stream_len(StreamObject* self) {
+    return self->batch->size();
+}
+
+static PySequenceMethods StreamAsSequence = {
+    .sq_length = reinterpret_cast<lenfunc>(Stream_len),
 };
 
-static_assert(Buf<PyBytes>);
+static PyTypeObject StreamType = {
+    .ob_base = PyVarObject_HEAD_INIT(nullptr, 0)
+    .tp_name = "fastreq.Stream",
+    .tp_basicsize = sizeof(StreamObject),
+    .tp_dealloc = reinterpret_cast<destructor>(Stream_dealloc),
+    .tp_as_sequence = &StreamAsSequence,
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_doc = "Responses of a background batch download, yielded in url order as they arrive.",
+    .tp_iter = PyObject_SelfIter,
+    .tp_iternext = reinterpret_cast<iternextfunc>(Stream_next),
+    .tp_methods = StreamMethods,
+};
+
+static PyObject* new_stream(const shared_ptr<DownloadClient>& client, vector<string> urls) {
+    StreamObject* self = PyObject_New(StreamObject, &StreamType);
+    if (!self) {
+        return nullptr;
+    }
+    new (&self->client) shared_ptr<DownloadClient>(client);
+    new (&self->batch) shared_ptr<Batch<Charm>>();
+    self->next = 0;
+    try {
+        self->batch = client->submit(std::move(urls));
+    } catch (const std::exception& e) {
+        Py_DECREF(self);
+        PyErr_SetString(PyExc_RuntimeError, e.what());
+        return nullptr;
+    }
+    return reinterpret_cast<PyObject*>(self);
+}
+
+// Connect a new client; returns nullptr with a Python error set.
+static shared_ptr<DownloadClient> start_client(uint16_t remote_port, Options options) {
+    shared_ptr<DownloadClient> client;
+    std::string error;
+    Py_BEGIN_ALLOW_THREADS
+    try {
+        client = std::make_shared<DownloadClient>(remote_port, options);
+    } catch (const std::exception& e) {
+        error = e.what();
+    }
+    Py_END_ALLOW_THREADS
+    if (!client) {
+        PyErr_SetString(PyExc_RuntimeError, error.c_str());
+    }
+    return client;
+}
 
-static PyObject* m4c_get(PyObject* /*self*/, PyObject* args) {
+static PyObject* m4c_stream(PyObject* /*self*/, PyObject* args, PyObject* kwds) {
+    static const char* kwlist[] = {"urls", "remote_port", "connections", "depth", "threads", nullptr};
     PyObject* urls_list;
     uint16_t remote_port = 18080;
+    Py_ssize_t connections = Options{}.connections, depth = Options{}.depth, threads = Options{}.threads;
     
-    if (!PyArg_ParseTuple(args, "O|H", &urls_list, &remote_port)) {
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|Hnnn", const_cast<char**>(kwlist),
+                                     &urls_list, &remote_port, &connections, &depth, &threads)) {
+        return nullptr;
+    }
+    Options options;
+    if (!parse_options(connections, depth, threads, options)) {
         return nullptr;
     }
     
-    if (!PyList_Check(urls_list)) {
-        PyErr_SetString(PyExc_TypeError, "urls must be a list of strings");
+    std::vector<std::string> urls;
+    if (!parse_urls(urls_list, urls)) {
         return nullptr;
     }
     
+    shared_ptr<DownloadClient> client = start_client(remote_port, options);
+    if (!client) {
+        return nullptr;
+    }
+    return new_stream(client, std::move(urls));
+}
+
+// Why a packed batch is unusable, or nullptr if it is fine.
+static const char* check_arena(const Py_buffer& data, const Py_buffer& offsets) {
+    if (offsets.len % sizeof(uint64_t) != 0 || offsets.len == 0) {
+        return "offsets must hold len+1 uint64 values";
+    }
+    span<const uint64_t> off{static_cast<const uint64_t*>(offsets.buf), offsets.len / sizeof(uint64_t)};
+    for (size_t i = 0; i + 1 < off.size(); ++i) {
+        if (off[i] > off[i+1]) return "offsets must not decrease";
+    }
+    if (off.back() > static_cast<uint64_t>(data.len)) {
+        return "offsets point past the end of data";
+    }
+    return nullptr;
+}
+
+// Why price buckets of charm ids are unusable for a batch of `n` charms, or nullptr.
+static const char* check_buckets(const Py_buffer& order, const Py_buffer& buckets, size_t n) {
+    if (order.len % sizeof(uint32_t) != 0) {
+        return "order must hold uint32 values";
+    }
+    if (buckets.len != (PRICES + 1) * sizeof(uint64_t)) {
+        return "buckets must hold 257 uint64 values";
+    }
+    span<const uint32_t> ids{static_cast<const uint32_t*>(order.buf), order.len / sizeof(uint32_t)};
+    span<const uint64_t> bounds{static_cast<const uint64_t*>(buckets.buf), PRICES + 1};
+    for (size_t p = 0; p < PRICES; ++p) {
+        if (bounds[p] > bounds[p+1]) return "buckets must not decrease";
+    }
+    if (bounds.back() > ids.size()) {
+        return "buckets point past the end of order";
+    }
+    for (uint32_t id : ids) {
+        if (id >= n) return "order holds an id past the end of offsets";
+    }
+    return nullptr;
+}
+
+// Release every buffer and raise ValueError(error) if set; returns whether it was not.
+static bool release_on_error(const char* error, std::initializer_list<Py_buffer*> buffers) {
+    if (!error) {
+        return true;
+    }
+    for (Py_buffer* buffer : buffers) {
+        PyBuffer_Release(buffer);
+    }
+    PyErr_SetString(PyExc_ValueError, error);
+    return false;
+}
+
+// Parse (data, offsets) of a packed batch; returns false with a Python error set.
+// On success both buffers must be released by the caller.
+static bool parse_arena(PyObject* args, Py_buffer& data, Py_buffer& offsets) {
+    if (!PyArg_ParseTuple(args, "y*y*", &data, &offsets)) {
+        return false;
+    }
+    return release_on_error(check_arena(data, offsets), {&data, &offsets});
+}
+
+static PyObject* m4c_filter_by_checksum(PyObject* /*self*/, PyObject* args) {
+    Py_buffer data, offsets;
+    if (!parse_arena(args, data, offsets)) {
+        return nullptr;
+    }
+    
+    ChecksumResult res;
+    Py_BEGIN_ALLOW_THREADS
+    res = filter_by_checksum(static_cast<const uint8_t*>(data.buf),
+                             {static_cast<const uint64_t*>(offsets.buf), offsets.len / sizeof(uint64_t)});
+    Py_END_ALLOW_THREADS
+    PyBuffer_Release(&data);
+    PyBuffer_Release(&offsets);
+    
+    PyObject* valid = PyBytes_FromStringAndSize(reinterpret_cast<const char*>(res.valid.data()), res.valid.size());
+    PyObject* order = to_view(res.order, "I");
+    PyObject* buckets = to_view(res.buckets, "Q");
+    if (!valid || !order || !buckets) {
+        Py_XDECREF(valid);
+        Py_XDECREF(order);
+        Py_XDECREF(buckets);
+        return nullptr;
+    }
+    return Py_BuildValue("(NNN)", valid, order, buckets);
+}
+
+// Parse (data, offsets, order, buckets) of a packed batch grouped by price;
+// returns false with a Python error set.
+static bool parse_by_price(PyObject* args, Py_buffer& data, Py_buffer& offsets,
+                           Py_buffer& order, Py_buffer& buckets) {
+    if (!PyArg_ParseTuple(args, "y*y*y*y*", &data, &offsets, &order, &buckets)) {
+        return false;
+    }
+    const char* error = check_arena(data, offsets);
+    if (!error) {
+        error = check_buckets(order, buckets, offsets.len / sizeof(uint64_t) - 1);
+    }
+    return release_on_error(error, {&data, &offsets, &order, &buckets});
+}
+
+// Run `kernel` (dedup or split_levels) over a batch grouped by price, without the
+// GIL; returns its (order, buckets) as memoryviews.
+template<class Kernel>
+static PyObject* by_price(PyObject* args, Kernel kernel) {
+    Py_buffer data, offsets, order, buckets;
+    if (!parse_by_price(args, data, offsets, order, buckets)) {
+        return nullptr;
+    }
+    
+    decltype(kernel(nullptr, {}, {}, {})) res;
+    Py_BEGIN_ALLOW_THREADS
+    res = kernel(static_cast<const uint8_t*>(data.buf),
+                 {static_cast<const uint64_t*>(offsets.buf), offsets.len / sizeof(uint64_t)},
+                 {static_cast<const uint32_t*>(order.buf), order.len / sizeof(uint32_t)},
+                 {static_cast<const uint64_t*>(buckets.buf), PRICES + 1});
+    Py_END_ALLOW_THREADS
+    for (Py_buffer* buffer : {&data, &offsets, &order, &buckets}) {
+        PyBuffer_Release(buffer);
+    }
+    
+    PyObject* res_order = to_view(res.order, "I");
+    PyObject* res_buckets = to_view(res.buckets, "Q");
+    if (!res_order || !res_buckets) {
+        Py_XDECREF(res_order);
+        Py_XDECREF(res_buckets);
+        return nullptr;
+    }
+    return Py_BuildValue("(NN)", res_order, res_buckets);
+}
+
+static PyObject* m4c_dedup(PyObject* /*self*/, PyObject* args) {
+    return by_price(args, dedup);
+}
+
+static PyObject* m4c_split_levels(PyObject* /*self*/, PyObject* args) {
+    return by_price(args, split_levels);
+}
+
+// Persistent connection pool, shared by every batch submitted through it
+typedef struct {
+    PyObject_HEAD
+    shared_ptr<DownloadClient> client;
+} ClientObject;
+
+static PyObject* Client_new(PyTypeObject* type, PyObject* args, PyObject* kwds) {
+    static const char* kwlist[] = {"remote_port", "connections", "depth", "threads", nullptr};
+    uint16_t remote_port = 18080;
+    Py_ssize_t connections = Options{}.connections, depth = Options{}.depth, threads = Options{}.threads;
+    
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "|Hnnn", const_cast<char**>(kwlist),
+                                     &remote_port, &connections, &depth, &threads)) {
+        return nullptr;
+    }
+    Options options;
+    if (!parse_options(connections, depth, threads, options)) {
+        return nullptr;
+    }
+    
+    ClientObject* self = reinterpret_cast<ClientObject*>(type->tp_alloc(type, 0));
+    if (!self) {
+        return nullptr;
+    }
+    new (&self->client) shared_ptr<DownloadClient>(start_client(remote_port, options));
+    if (!self->client) {
+        Py_DECREF(self);
+        return nullptr;
+    }
+    return reinterpret_cast<PyObject*>(self);
+}
+
+static void Client_dealloc(ClientObject* self) {
+    Py_BEGIN_ALLOW_THREADS
+    self->client.~shared_ptr();
+    Py_END_ALLOW_THREADS
+    Py_TYPE(self)->tp_free(reinterpret_cast<PyObject*>(self));
+}
+
+static PyObject* Client_stream(ClientObject* self, PyObject* args) {
+    PyObject* urls_list;
+    
+    if (!PyArg_ParseTuple(args, "O", &urls_list)) {
+        return nullptr;
+    }
+    
+    std::vector<std::string> urls;
+    if (!parse_urls(urls_list, urls)) {
+        return nullptr;
+    }
+    return new_stream(self->client, std::move(urls));
+}
+
+static PyObject* Client_get_as(ClientObject* self, PyObject* args, Convert convert) {
+    PyObject* groups_list;
+    
+    if (!PyArg_ParseTuple(args, "O", &groups_list)) {
+        return nullptr;
+    }
+    
+    if (!PyList_Check(groups_list)) {
+        PyErr_SetString(PyExc_TypeError, "groups must be a list of url lists");
+        return nullptr;
+    }
+    
+    // Submit every group before waiting, so they share the pipelines
+    vector<shared_ptr<Batch<Charm>>> batches;
+    Py_ssize_t size = PyList_Size(groups_list);
     try {
-        // Convert Python list to C++ vector
-        std::vector<std::string> urls;
-        Py_ssize_t size = PyList_Size(urls_list);
-        urls.reserve(size);
-        
         for (Py_ssize_t i = 0; i < size; ++i) {
-            PyObject* item = PyList_GetItem(urls_list, i);
-            if (!PyUnicode_Check(item)) {
-                PyErr_SetString(PyExc_TypeError, "all urls must be strings");
+            std::vector<std::string> urls;
+            if (!parse_urls(PyList_GetItem(groups_list, i), urls)) {
                 return nullptr;
             }
-            
-            Py_ssize_t len;
-            const char* str = PyUnicode_AsUTF8AndSize(item, &len);
-            if (!str) {
-                return nullptr;
-            }
-            urls.emplace_back(str, len);
+            batches.push_back(self->client->submit(std::move(urls)));
         }
-        
-        // Call the implementation
-        auto results = fastreq<PyBytes>(std::move(urls), remote_port);
-        
-        // Convert results to Python list
-        PyObject* result_list = PyList_New(results.size());
-        if (!result_list) {
-            return nullptr;
-        }
-        
-        for (size_t i = 0; i < results.size(); ++i) {
-            PyObject* bytes_obj = results[i].release();
-            if (!bytes_obj) {
-                Py_DECREF(result_list);
-                return nullptr;
-            }
-            PyList_SET_ITEM(result_list, i, bytes_obj);
-        }
-        
-        return result_list;
-        
     } catch (const std::exception& e) {
         PyErr_SetString(PyExc_RuntimeError, e.what());
         return nullptr;
     }
+    
+    vector<vector<Charm>> results(batches.size());
+    std::string error;
+    Py_BEGIN_ALLOW_THREADS
+    try {
+        for (size_t i = 0; i < batches.size(); ++i) {
+            results[i] = batches[i]->take_all();
+        }
+    } catch (const std::exception& e) {
+        error = e.what();
+    }
+    Py_END_ALLOW_THREADS
+    if (!error.empty()) {
+        PyErr_SetString(PyExc_RuntimeError, error.c_str());
+        return nullptr;
+    }
+    
+    // Convert results to Python list of lists
+    PyObject* result_list = PyList_New(results.size());
+    if (!result_list) {
+        return nullptr;
+    }
+    for (size_t i = 0; i < results.size(); ++i) {
+        PyObject* group = convert(results[i]);
+        if (!group) {
+            Py_DECREF(result_list);
+            return nullptr;
+        }
+        PyList_SET_ITEM(result_list, i, group);
+    }
+    return result_list;
+}
+
+static PyObject* Client_get(ClientObject* self, PyObject* args) {
+    return Client_get_as(self, args, to_pylist);
 }
 
+static PyObject* Client_get_arena(ClientObject* self, PyObject* args) {
+    return Client_get_as(self, args, to_arena);
+}
+
+static PyMethodDef ClientMethods[] = {
+    {"get", reinterpret_cast<PyCFunction>(Client_get), METH_VARARGS,
+     "Download several groups of urls at once; returns the responses per group."},
+    {"get_arena", reinterpret_cast<PyCFunction>(Client_get_arena), METH_VARARGS,
+     "As `get`, but returns one (data, offsets) pair per group, as `fastreq.get_arena`."},
+    {"stream", reinterpret_cast<PyCFunction>(Client_stream), METH_VARARGS,
+     "Queue a group of urls and return an iterator over its responses, as `fastreq.stream`."},
+    {NULL, NULL, 0, NULL}
+};
+
+static PyTypeObject ClientType = {
+    .ob_base = PyVarObject_HEAD_INIT(nullptr, 0)
+    .tp_name = "fastreq.Client",
+    .tp_basicsize = sizeof(ClientObject),
+    .tp_dealloc = reinterpret_cast<destructor>(Client_dealloc),
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_doc = "Keep-alive connections to localhost:[remote_port], reused by every batch.",
+    .tp_methods = ClientMethods,
+    .tp_new = Client_new,
+};
+
 // Module method table
 static PyMethodDef FastReqMethods[] = {
-    {"get", m4c_get, METH_VARARGS, 
+    {"get", reinterpret_cast<PyCFunction>(m4c_get), METH_VARARGS | METH_KEYWORDS,
      "Perform batch HTTP 1.1 get from localhost:[remote_port][url].\n\n"
-     "It assumes remote is exactly the m4c server, and cannot used on any normal HTTP server."},
+     "It assumes remote is exactly the m4c server, and cannot used on any normal HTTP server.\n\n"
+     "get(urls, remote_port=18080, connections=8, depth=64, threads=1): requests are spread over "
+     "`connections` connections with at most `depth` requests in flight on each, served by "
+     "`threads` event loops without holding the GIL."},
+    {"get_arena", reinterpret_cast<PyCFunction>(m4c_get_arena), METH_VARARGS | METH_KEYWORDS,
+     "As `get`, but packs every response, in url order, into one buffer.\n\n"
+     "Returns (data, offsets): a memoryview of the bodies back to back and a memoryview "
+     "of len(urls)+1 uint64 offsets, so response i is data[offsets[i]:offsets[i+1]]."},
+    {"filter_by_checksum", m4c_filter_by_checksum, METH_VARARGS,
+     "filter_by_checksum(data, offsets) -> (valid, order, buckets)\n\n"
+     "Check every charm of a `get_arena` batch: valid is a bitmap (bit i%8 of byte i//8) "
+     "of charms whose content XORs to their price; order lists the valid charm ids "
+     "grouped by price, and those of price p are order[buckets[p]:buckets[p+1]]."},
+    {"dedup", m4c_dedup, METH_VARARGS,
+     "dedup(data, offsets, order, buckets) -> (order, buckets)\n\n"
+     "Drop the charms of `order` that are the same as an earlier one of their price, "
+     "keeping the first by id of each kind; order and buckets are as `filter_by_checksum` "
+     "returns them."},
+    {"split_levels", m4c_split_levels, METH_VARARGS,
+     "split_levels(data, offsets, order, buckets) -> (order, buckets)\n\n"
+     "Regroup the charms of `order` (grouped by price) by level within each price; those "
+     "of price p and level l are order[buckets[p*17+l]:buckets[p*17+l+1]]."},
+    {"stream", reinterpret_cast<PyCFunction>(m4c_stream), METH_VARARGS | METH_KEYWORDS,
+     "Start the same batch download as `get` on a background thread.\n\n"
+     "Returns an iterator yielding the responses in url order as soon as they arrive."},
     {NULL, NULL, 0, NULL}
 };
 
@@ -166,5 +662,17 @@ static struct PyModuleDef fastreqmodule = {
 };
 
 PyMODINIT_FUNC PyInit_fastreq() {
-    return PyModule_Create(&fastreqmodule);
+    if (PyType_Ready(&StreamType) < 0 || PyType_Ready(&ClientType) < 0) {
+        return nullptr;
+    }
+    PyObject* m = PyModule_Create(&fastreqmodule);
+    if (!m) {
+        return nullptr;
+    }
+    if (PyModule_AddObjectRef(m, "Stream", reinterpret_cast<PyObject*>(&StreamType)) < 0 ||
+        PyModule_AddObjectRef(m, "Client", reinterpret_cast<PyObject*>(&ClientType)) < 0) {
+        Py_DECREF(m);
+        return nullptr;
+    }
+    return m;
 }
\ No newline at end of file
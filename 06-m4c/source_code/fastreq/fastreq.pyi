@@ -1,6 +1,116 @@
-def get(urls: list[str], remote_port: int = 18080) -> list[bytes]:
+from typing import Iterator
+
+def get(urls: list[str], remote_port: int = 18080,
+        connections: int = 8, depth: int = 64, threads: int = 1) -> list[bytes]:
     '''
     Perform batch HTTP 1.1 get from localhost:[remote_port][url].
 
     It assumes remote is exactly the m4c server, and cannot used on any normal HTTP server.
+
+    Requests are spread over `connections` keep-alive connections, each with at most
+    `depth` requests in flight; see `fastreq.tune` for picking them. The connections
+    are sharded over `threads` epoll loops, and the GIL is released while they run.
+    '''
+
+def get_arena(urls: list[str], remote_port: int = 18080,
+              connections: int = 8, depth: int = 64, threads: int = 1) -> tuple[memoryview, memoryview]:
+    '''
+    As `get`, but packs every response, in url order, into one buffer instead of one
+    bytes object each.
+
+    Returns (data, offsets): a read-only byte memoryview of the bodies back to back and
+    a memoryview of len(urls)+1 uint64 offsets (format 'Q'), so response i is
+    data[offsets[i]:offsets[i+1]]. Both can be wrapped without copying, e.g. by
+    `numpy.frombuffer`.
+    '''
+
+def filter_by_checksum(data: bytes | memoryview,
+                       offsets: bytes | memoryview) -> tuple[bytes, memoryview, memoryview]:
+    '''
+    Check every charm of a `get_arena` batch in one pass, without the GIL.
+
+    A charm is valid when the XOR of its content (all but the last byte) equals its
+    price (the last byte). Returns (valid, order, buckets): valid is a bitmap, bit
+    i%8 of byte i//8 set iff charm i is valid; order (format 'I') lists the valid
+    charm ids grouped by price, ascending within a price; the ids of price p are
+    order[buckets[p]:buckets[p+1]] (buckets has format 'Q' and 257 entries).
+    '''
+
+def dedup(data: bytes | memoryview, offsets: bytes | memoryview,
+          order: bytes | memoryview, buckets: bytes | memoryview) -> tuple[memoryview, memoryview]:
+    '''
+    Drop near-duplicate charms, without the GIL. Two charms of a price are the same
+    when their contents have equal length, equal last 16 bytes and differ in at most
+    3 of the other bytes; a charm is dropped when it is the same as any earlier one
+    in `order`, dropped or not, so the first by id of each kind is kept.
+
+    `order` and `buckets` are as `filter_by_checksum` returns them, and so is the
+    result. Candidates are looked up by (length, last 16 bytes), so each charm is
+    only compared with the ones it could be the same as.
+    '''
+
+def split_levels(data: bytes | memoryview, offsets: bytes | memoryview,
+                 order: bytes | memoryview, buckets: bytes | memoryview) -> tuple[memoryview, memoryview]:
+    '''
+    Regroup the charms of `order` (grouped by price, as `dedup` returns them) by
+    level within each price, keeping id order, without the GIL.
+
+    The level of a charm is the length of the run of equal symbols ending the base64
+    of its content with the padding removed, capped at 16. It is computed from the
+    last few bytes only; no base64 is built. Returns (order, buckets): the charms of
+    price p and level l are order[buckets[p*17+l]:buckets[p*17+l+1]] (level 0 is
+    always empty).
+    '''
+
+class Stream(Iterator[bytes]):
+    '''
+    Responses of a background batch download, yielded in url order as they arrive.
+
+    Dropping a stream does not wait for its download. A stream from `Client.stream`
+    only lets go of the batch, which keeps downloading on the client. One from the
+    module-level `stream` owns its client, so dropping it stops the client and
+    cancels the responses still in flight.
     '''
+    def __next__(self) -> bytes: ...
+    def __len__(self) -> int: ...
+
+    def arena(self) -> tuple[memoryview, memoryview]:
+        '''
+        Wait for every response not yielded yet and return them as (data, offsets),
+        as `get_arena`. The stream is exhausted afterwards.
+        '''
+
+def stream(urls: list[str], remote_port: int = 18080,
+           connections: int = 8, depth: int = 64, threads: int = 1) -> Stream:
+    '''
+    Start the same batch download as `get` on a background thread and return at once.
+
+    The download does not hold the GIL, so the caller can process earlier responses
+    (or other batches) while the rest are still in flight.
+    '''
+
+class Client:
+    '''
+    Keep-alive connections to localhost:[remote_port], kept open across calls and
+    sharded over `threads` background epoll loops.
+
+    Batches are pipelined behind the ones already in flight, so consecutive groups
+    never pay for reconnecting.
+    '''
+    def __init__(self, remote_port: int = 18080,
+                 connections: int = 8, depth: int = 64, threads: int = 1) -> None: ...
+
+    def get(self, groups: list[list[str]]) -> list[list[bytes]]:
+        '''
+        Download several groups of urls at once; returns the responses per group.
+        '''
+
+    def get_arena(self, groups: list[list[str]]) -> list[tuple[memoryview, memoryview]]:
+        '''
+        As `get`, but returns one (data, offsets) pair per group, as `get_arena`.
+        '''
+
+    def stream(self, urls: list[str]) -> Stream:
+        '''
+        Queue a group of urls and return an iterator over its responses, as `stream`.
+        '''
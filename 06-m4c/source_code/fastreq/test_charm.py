@@ -0,0 +1,166 @@
+'''
+check of the charm kernels (filter_by_checksum, dedup, split_levels) against the
+Python reference of the original main.py, on random groups (run from source_code):
+
+    python -m fastreq.test_charm
+'''
+import base64, random
+from array import array
+from functools import reduce
+from fastreq import fastreq
+
+PRICES = 256
+LEVELS = 17
+B64 = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+
+def xor(content: bytes) -> int:
+    return reduce(lambda a, b: a ^ b, content, 0)
+
+def reference_by_price(charms: list[bytes]) -> list[tuple[list[int], list[int]]]:
+    '''ids of the valid charms of each price, and of the first of each kind, as main.py did'''
+    charms_by_price = [[] for _ in range(PRICES)]
+    for i, charm in enumerate(charms):
+        # the server never sends an empty charm; it has no price and is invalid
+        if charm:
+            charms_by_price[charm[-1]].append(i)
+
+    for price in range(PRICES):
+        # 3. filter by checksum
+        xor_filter = lambda i: xor(charms[i][:-1]) == charms[i][-1]
+        ids = list(filter(xor_filter, charms_by_price[price]))
+        # 4. dedup
+        dedup_ids = []
+        for k, i in enumerate(ids):
+            dup = False
+            for j in ids[:k]:
+                charm_same = lambda ch1, ch2: (
+                    len(ch1) == len(ch2) and ch1[-16:] == ch2[-16:] and
+                    sum(c1 != c2 for c1, c2 in zip(ch1[:-16], ch2[:-16])) <= 3
+                )
+                if charm_same(charms[i][:-1], charms[j][:-1]): # dup
+                    dup = True
+                    break
+            if not dup:
+                dedup_ids.append(i)
+        charms_by_price[price] = (ids, dedup_ids)
+    return charms_by_price
+
+def reference_level(content: bytes) -> int:
+    '''
+    level of main.py; a run reaching the start of a short base64 counts its whole length
+    (main.py indexed past it), and empty content is level 1
+    '''
+    b64 = base64.b64encode(content).decode('ascii').replace("=", "") # remove padding
+    return next((n for n in range(1, 16) if n >= len(b64) or b64[-1] != b64[-(n+1)]), 16)
+
+def arena(charms: list[bytes]) -> tuple[bytes, array]:
+    offsets = array('Q', [0])
+    for charm in charms:
+        offsets.append(offsets[-1] + len(charm))
+    return b''.join(charms), offsets
+
+def by_price(order: memoryview, buckets: memoryview) -> list[list[int]]:
+    return [list(order[buckets[p]:buckets[p+1]]) for p in range(PRICES)]
+
+def priced(content: bytes, rng: random.Random) -> bytes:
+    '''`content` with its checksum as price, or now and then a wrong one'''
+    price = xor(content)
+    if rng.random() < 0.1:
+        price ^= rng.randrange(1, 256)
+    return content + bytes([price])
+
+def near(content: bytes, rng: random.Random) -> bytes:
+    '''
+    a copy of `content` with up to 4 of its bytes before the last 16 changed, or one of
+    those 16; changes of more than one byte keep its checksum, so it keeps its price
+    '''
+    c = bytearray(content)
+    head = max(0, len(c) - 16)
+    if head == 0 or rng.random() < 0.2:
+        if c:
+            c[rng.randrange(len(c))] ^= rng.randrange(1, 256)
+        return bytes(c)
+    positions = rng.sample(range(head), min(head, rng.randint(1, 4)))
+    deltas = [rng.randrange(1, 256) for _ in positions[1:]]
+    if len(positions) > 1:
+        deltas.append(xor(deltas) or 1)
+    else:
+        deltas.append(rng.randrange(1, 256))
+    for pos, delta in zip(positions, deltas):
+        c[pos] ^= delta
+    return bytes(c)
+
+def tailed(length: int, run: int, rng: random.Random) -> bytes:
+    '''
+    content of `length` bytes whose base64 ends in `run` equal symbols (all of them if
+    it is shorter), the last one a valid end for its length % 3
+    '''
+    rest = length % 3
+    symbols = length // 3 * 4 + (rest + 1 if rest else 0)
+    # the bits after the content in the last symbol are zero
+    last = rng.randrange(0, 64, (1, 16, 4)[rest])
+    b64 = bytearray(rng.choice(B64) for _ in range(symbols))
+    run = min(run, symbols)
+    b64[symbols - run:] = bytes([B64[last]]) * run
+    if run < symbols:
+        b64[symbols - run - 1] = rng.choice(B64.replace(bytes([B64[last]]), b""))
+    content = base64.b64decode(bytes(b64) + b"=" * (-symbols % 4))
+    assert len(content) == length
+    return content
+
+def random_group(n: int, rng: random.Random) -> list[bytes]:
+    '''
+    random charms: empty and short ones, wrong checksums, exact duplicates and near
+    duplicates of earlier charms, and tails of every level at every length % 3
+    '''
+    charms = []
+    for _ in range(n):
+        r = rng.random()
+        if charms and r < 0.15:
+            charms.append(rng.choice(charms))
+        elif charms and r < 0.4:
+            charms.append(priced(near(rng.choice(charms)[:-1], rng), rng))
+        elif r < 0.42:
+            charms.append(b'')
+        elif r < 0.7:
+            charms.append(priced(tailed(rng.randint(0, 40), rng.randint(1, 20), rng), rng))
+        else:
+            charms.append(priced(rng.randbytes(rng.choice([0, 1, 2, 15, 16, 17, rng.randint(0, 40)])), rng))
+    return charms
+
+def check(charms: list[bytes]):
+    want = reference_by_price(charms)
+    data, offsets = arena(charms)
+
+    valid, order, buckets = fastreq.filter_by_checksum(data, offsets)
+    for i, charm in enumerate(charms):
+        assert bool(valid[i // 8] >> (i % 8) & 1) == (bool(charm) and xor(charm) == 0), f"checksum of {charm!r}"
+    assert by_price(order, buckets) == [ids for ids, _ in want], "filter_by_checksum"
+
+    order, buckets = fastreq.dedup(data, offsets, order, buckets)
+    assert by_price(order, buckets) == [ids for _, ids in want], "dedup"
+
+    order, buckets = fastreq.split_levels(data, offsets, order, buckets)
+    levels = [[list(order[buckets[j]:buckets[j+1]]) for j in range(p * LEVELS, (p + 1) * LEVELS)] for p in range(PRICES)]
+    for p, (_, ids) in enumerate(want):
+        want_levels = [[] for _ in range(LEVELS)]
+        for i in ids:
+            want_levels[reference_level(charms[i][:-1])].append(i)
+        assert levels[p] == want_levels, f"split_levels of price {p}"
+
+def main():
+    rng = random.Random(0)
+    check([])
+    check([b''] * 3)
+    for n in (1, 2, 10, 100, 1000, 3000):
+        check(random_group(n, rng))
+    # every level at every length % 3, and runs reaching the start of short content
+    for length in range(0, 30):
+        for run in range(1, 19):
+            content = tailed(length, run, rng)
+            assert reference_level(content) == min(run, 16, max(1, len(base64.b64encode(content).rstrip(b"="))))
+            check([content + bytes([xor(content)])])
+    print("filter_by_checksum, dedup, split_levels: ok")
+
+if __name__ == "__main__":
+    main()
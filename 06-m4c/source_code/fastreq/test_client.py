@@ -0,0 +1,76 @@
+'''
+fastreq.Client against ../fake_server.py: dropping a stream mid-download, and the
+server dying mid-batch with the stream dropped (run from source_code):
+
+    python -m fastreq.test_client
+'''
+import gc, os, socket, subprocess, sys, time
+from fastreq import fastreq
+
+FAKE_SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "fake_server.py")
+GROUP_SIZE = 200000
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(port: int) -> subprocess.Popen:
+    server = subprocess.Popen([sys.executable, FAKE_SERVER, "--port", str(port), "--groups", "2",
+                               "--group-size", str(GROUP_SIZE), "--min-len", "16", "--max-len", "64",
+                               "--mean-len", "32"], stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return server
+        except ConnectionRefusedError:
+            assert server.poll() is None and time.monotonic() < deadline, "fake server did not start"
+            time.sleep(0.05)
+
+def urls(group_id: int) -> list[str]:
+    return [f"/{group_id}/{i}" for i in range(GROUP_SIZE)]
+
+def test_drop_stream(port: int):
+    '''a stream dropped mid-download keeps downloading; later batches are unaffected'''
+    client = fastreq.Client(port, 8, 64, 4)
+    expected = client.get([urls(1)[:1000]])[0]
+    stream = client.stream(urls(0))
+    next(stream)
+    del stream
+    gc.collect()
+    assert client.get([urls(1)[:1000]])[0] == expected
+
+def test_server_dies(port: int, server: subprocess.Popen):
+    '''the server killed mid-batch fails the batch, frees the dropped stream and breaks the client'''
+    client = fastreq.Client(port, 8, 64, 4)
+    stream = client.stream(urls(0))
+    next(stream)
+    server.kill()
+    server.wait()
+    del stream
+    gc.collect()
+    # each new batch drops the finished ones; the loops may take a moment to notice
+    deadline = time.monotonic() + 5
+    while True:
+        try:
+            client.get([urls(1)[:10]])
+        except RuntimeError:
+            break
+        assert time.monotonic() < deadline, "client kept working without a server"
+        time.sleep(0.01)
+    del client
+
+def main():
+    port = free_port()
+    server = start_server(port)
+    try:
+        test_drop_stream(port)
+        print("drop stream: ok")
+        test_server_dies(port, server)
+        print("server dies: ok")
+    finally:
+        server.kill()
+
+if __name__ == "__main__":
+    main()
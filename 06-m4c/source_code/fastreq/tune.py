@@ -0,0 +1,33 @@
+import os, time
+from . import fastreq
+
+def candidates(cores: int | None = None) -> list[tuple[int, int]]:
+    '''
+    (connections, depth) settings worth probing on a host with `cores` usable cores
+    (by default the cores this process may run on, e.g. under `taskset`).
+    '''
+    if cores is None:
+        cores = len(os.sched_getaffinity(0))
+    connections = sorted({max(1, cores // 2), cores, 2 * cores})
+    return [(c, d) for c in connections for d in (16, 64, 256)]
+
+def autotune(urls: list[str], remote_port: int = 18080,
+             settings: list[tuple[int, int]] | None = None, probe: int = 4096,
+             threads: int = 1) -> tuple[int, int]:
+    '''
+    Download the first `probe` urls once per (connections, depth) setting, on
+    `threads` event loops, and return the fastest setting.
+
+    The urls are fetched once more up front, untimed, so that the first setting does
+    not pay for the server warming up.
+    '''
+    urls = urls[:probe]
+    fastreq.get(urls, remote_port, threads=threads)
+    best, best_time = (8, 64), float("inf")
+    for connections, depth in settings or candidates():
+        start = time.perf_counter()
+        fastreq.get(urls, remote_port, connections, depth, threads)
+        elapsed = time.perf_counter() - start
+        if elapsed < best_time:
+            best, best_time = (connections, depth), elapsed
+    return best
@@ -1,64 +1,122 @@
 #!/usr/bin/env python
-import requests, base64, hashlib
-from functools import reduce
+import hashlib, json, os, socket, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
 from fastreq import fastreq
+import charm_cache
+from fastreq.tune import autotune
 
 REMOTE_PORT = 18080  # 根据实际服务器地址修改
+PREFETCH_GROUPS = 1  # groups downloading in the background while one is processed
+CONNECTIONS = int(os.environ.get("M4C_CONNECTIONS", 8))
+PIPELINE_DEPTH = int(os.environ.get("M4C_DEPTH", 64))  # max requests in flight per connection
+AUTOTUNE = os.environ.get("M4C_AUTOTUNE") == "1"  # probe settings on the first group instead
+# epoll threads parsing responses; the rest of the cores run the server and the filters
+THREADS = int(os.environ.get("M4C_THREADS", max(1, len(os.sched_getaffinity(0)) // 4)))
 
-def download_cases(group_id: int, group_size: int):
-    return fastreq.get([f"/{group_id}/{i}" for i in range(group_size)], REMOTE_PORT)
+def cpu_count(cpus: str) -> int:
+    '''number of cpus in a list like "0,1,4-7", as evaluate.py sets M4C_CORES'''
+    ranges = (r.split("-") for r in cpus.split(",") if r)
+    return sum(int(r[-1]) - int(r[0]) + 1 for r in ranges)
 
-def run_group(group_id: int, group_size: int) -> list[list[list[bytes]]]:
+# groups filtered at once; the kernels release the GIL, so threads run them in parallel
+CORES = cpu_count(os.environ.get("M4C_CORES", "")) or len(os.sched_getaffinity(0))
+
+def wait_for_server(port: int, timeout: float = 5.0):
+    '''poll until the server accepts connections, backing off from 50µs up to 5ms'''
+    deadline = time.monotonic() + timeout
+    delay = 50e-6
+    while True:
+        try:
+            socket.create_connection(("localhost", port)).close()
+            return
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(delay)
+            delay = min(delay * 2, 5e-3)
+
+def group_urls(group_id: int, group_size: int) -> list[str]:
+    return [f"/{group_id}/{i}" for i in range(group_size)]
+
+def download_cases(client: fastreq.Client, group_id: int, group_size: int):
+    return client.stream(group_urls(group_id, group_size))
+
+# (connections, depth) of the client connect() made, tuned or not; None until then
+connected: tuple[int, int] | None = None
+
+def connect(groups: list[int]) -> fastreq.Client:
+    '''one set of keep-alive connections for all groups'''
+    global connected
+    connections, depth = CONNECTIONS, PIPELINE_DEPTH
+    if AUTOTUNE and groups:
+        connections, depth = autotune(group_urls(0, groups[0]), REMOTE_PORT, threads=THREADS)
+        print(f"Tuned to {connections} connections, depth {depth}")
+    connected = connections, depth
+    return fastreq.Client(REMOTE_PORT, connections, depth, THREADS)
+
+def download_groups(groups: list[int]):
+    '''
+    yield (group_id, charm stream), keeping the next groups' downloads in flight;
+    groups in the charm cache are read from it instead, see charm_cache.py
+    '''
+    client = None  # connected on the first group not cached
+    pending = deque()
+    for group_id, group_size in enumerate(groups):
+        charms = charm_cache.load(group_id, group_size)
+        if charms is None:
+            client = client or connect(groups)
+            charms = charm_cache.store(group_id, group_size, download_cases(client, group_id, group_size))
+        pending.append((group_id, charms))
+        if len(pending) > PREFETCH_GROUPS:
+            yield pending.popleft()
+    yield from pending
+
+def run_group(group_id: int, charms: fastreq.Stream | charm_cache.Cached,
+              lap: Callable[[str], None] = lambda stage: None) -> list[memoryview]:
+    '''
+    returns the group's charms in hash order: by price, then level, then id;
+    `lap` is called as each stage ends, see bench.py
+    '''
     print("Running on group", group_id)
-    # 1. download charms
-    charms = download_cases(group_id, group_size)
+    # 1. download charms; the next groups keep downloading meanwhile
+    data, offsets = charms.arena()
+    lap("download")
 
-    # 2. divide by price
-    charms_by_price = [[] for _ in range(256)]
-    for charm in charms:
-        charms_by_price[charm[-1]].append(charm)
-        
-    for price in range(256):
-        # 3. filter by checksum
-        charms=charms_by_price[price]
-        xor_filter = lambda c: reduce(lambda a,b:a^b, c[:-1], 0) == c[-1]
-        charms = list(filter(xor_filter, charms))
-        # 4. dedup
-        dedup_charms = []
-        for i, c in enumerate(charms):
-            dup = False
-            for j in range(i):
-                charm_same = lambda ch1,ch2: (
-                    len(ch1) == len(ch2) and ch1[-16:] == ch2[-16:] and
-                    sum(c1 != c2 for c1, c2 in zip(ch1[:-16], ch2[:-16])) <= 3 
-                )
-                if charm_same(c[:-1], charms[j][:-1]): # dup
-                    dup = True
-                    break
-            if not dup:
-                dedup_charms.append(c)
-        charms_by_price[price] = dedup_charms
+    # 2. divide by price and 3. filter by checksum, in one native pass
+    _, order, buckets = fastreq.filter_by_checksum(data, offsets)
+    lap("checksum")
+    # 4. dedup: keep the first by id of each kind, indexed by (len, tail)
+    order, buckets = fastreq.dedup(data, offsets, order, buckets)
+    lap("dedup")
+    # 5. level, from the last bytes of each charm
+    order, _ = fastreq.split_levels(data, offsets, order, buckets)
+    lap("level")
 
-    # 5. level
-    levels = [[[] for _ in range(17)] for _ in range(256)]
-    for price in range(256):
-        for c in charms_by_price[price]:
-            b64 = base64.b64encode(c[:-1]).decode('ascii').replace("=", "") # remove padding
-            level = next((n for n in range(1,16) if b64[-1] != b64[-(n+1)]), 16)
-            levels[price][level].append(c)
-    
-    return levels
+    return [data[offsets[i]:offsets[i+1]] for i in order]
 
 def main():
     # group meta
-    groups = requests.get(f"http://localhost:{REMOTE_PORT}/").json()
+    wait_for_server(REMOTE_PORT)
+    groups = json.loads(fastreq.get(["/"], REMOTE_PORT, connections=1, depth=1)[0])
     # groups = groups[:1] # uncomment this line to run on one group
-    charms_by_group = list(map(lambda t: run_group(t[0],t[1]), enumerate(groups)))
-    
-    # 6. hash
-    concatenated = b''.join(ch[:-1] for g in charms_by_group for l in g for chs in l for ch in chs)
-    sha1_hash = hashlib.sha1(concatenated).hexdigest()
-    print(sha1_hash)
+    # 6. hash, fed group by group in group order, so only the groups being
+    # filtered are held in memory
+    sha1 = hashlib.sha1()
+    def hash_group(running: deque):
+        for charm in running.popleft().result():
+            sha1.update(charm[:-1])
+
+    with ThreadPoolExecutor(CORES) as pool:
+        running = deque()
+        for group_id, charms in download_groups(groups):
+            running.append(pool.submit(run_group, group_id, charms))
+            if len(running) >= CORES:
+                hash_group(running)
+        while running:
+            hash_group(running)
+    print(sha1.hexdigest())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,246 @@
+#include "dequant_kernels.h"
+#include <cstring>
+
+#if defined(__x86_64__)
+#include <cpuid.h>
+#include <immintrin.h>
+#elif defined(__aarch64__)
+#include <arm_neon.h>
+#endif
+
+// float -> fp16 位模式，就近偶数舍入（与 c10::Half 的转换相同）
+static inline uint16_t fp16_from_fp32(float f) {
+    const float scale_to_inf = 0x1.0p+112f;
+    const float scale_to_zero = 0x1.0p-110f;
+    uint32_t w;
+    std::memcpy(&w, &f, sizeof(w));
+    float base = (__builtin_fabsf(f) * scale_to_inf) * scale_to_zero;
+    const uint32_t shl1_w = w + w;
+    const uint32_t sign = w & 0x80000000u;
+    uint32_t bias = shl1_w & 0xFF000000u;
+    if (bias < 0x71000000u) bias = 0x71000000u;
+    const uint32_t bias_bits = (bias >> 1) + 0x07800000u;
+    float bias_f;
+    std::memcpy(&bias_f, &bias_bits, sizeof(bias_f));
+    base = bias_f + base;
+    uint32_t bits;
+    std::memcpy(&bits, &base, sizeof(bits));
+    const uint32_t exp_bits = (bits >> 13) & 0x00007C00u;
+    const uint32_t mantissa_bits = bits & 0x00000FFFu;
+    const uint32_t nonsign = exp_bits + mantissa_bits;
+    return (sign >> 16) | (shl1_w > 0xFF000000u ? 0x7E00u : nonsign);
+}
+
+// fp16 位模式 -> float（精确）
+static inline float fp32_from_fp16(uint16_t h) {
+    const uint32_t w = static_cast<uint32_t>(h) << 16;
+    const uint32_t sign = w & 0x80000000u;
+    const uint32_t two_w = w + w;
+    const uint32_t normalized_bits = (two_w >> 4) + (0xE0u << 23);
+    float normalized;
+    std::memcpy(&normalized, &normalized_bits, sizeof(normalized));
+    normalized *= 0x1.0p-112f;
+    const uint32_t denormalized_bits = (two_w >> 17) | (126u << 23);
+    float denormalized;
+    std::memcpy(&denormalized, &denormalized_bits, sizeof(denormalized));
+    denormalized -= 0.5f;
+    uint32_t bits;
+    if (two_w < (1u << 27)) {
+        std::memcpy(&bits, &denormalized, sizeof(bits));
+    } else {
+        std::memcpy(&bits, &normalized, sizeof(bits));
+    }
+    bits |= sign;
+    float f;
+    std::memcpy(&f, &bits, sizeof(f));
+    return f;
+}
+
+// 3 个字节 b0 b1 b2 按小端拼成 24 位，每 6 位一个值（与 utils.unsqueeze_from_6bit 一致）
+static void dequant_row_scalar(const uint8_t* src, uint16_t* dst, int64_t packed,
+                               int8_t zero_point, float scale) {
+    for (int64_t i = 0; i < packed; i += 3, src += 3, dst += 4) {
+        const uint32_t x = src[0] | src[1] << 8 | src[2] << 16;
+        for (int j = 0; j < 4; ++j) {
+            const int q = (x >> (6 * j)) & 63;
+            dst[j] = fp16_from_fp32(static_cast<float>(q - zero_point) * scale);
+        }
+    }
+}
+
+// 8 路分别累加，编译器可以向量化
+static float dot_scalar(const uint16_t* w, const float* x, int64_t n) {
+    float acc[8] = {};
+    int64_t i = 0;
+    for (; i + 8 <= n; i += 8) {
+        for (int j = 0; j < 8; ++j) {
+            acc[j] += fp32_from_fp16(w[i + j]) * x[i + j];
+        }
+    }
+    float sum = 0;
+    for (; i < n; ++i) {
+        sum += fp32_from_fp16(w[i]) * x[i];
+    }
+    for (float a : acc) {
+        sum += a;
+    }
+    return sum;
+}
+
+#if defined(__x86_64__)
+
+// 读 12 个字节到 128 位寄存器低位；行尾不足 16 字节时不越界
+static inline __m128i load12(const uint8_t* src, bool tail) {
+    if (!tail) return _mm_loadu_si128(reinterpret_cast<const __m128i*>(src));
+    alignas(16) uint8_t buf[16] = {};
+    std::memcpy(buf, src, 12);
+    return _mm_load_si128(reinterpret_cast<const __m128i*>(buf));
+}
+
+// 每次 4 个 3 字节组 -> 16 个值：pshufb 把组 k 的 3 个字节放进输出 4k..4k+3 对应的
+// 32 位通道，再分别右移 0/6/12/18 位取低 6 位
+__attribute__((target("avx2,f16c")))
+static inline __m128i dequant8_avx2(__m256i bytes, __m256i pick, __m256i zp, __m256 s) {
+    const __m256i shifts = _mm256_setr_epi32(0, 6, 12, 18, 0, 6, 12, 18);
+    const __m256i q = _mm256_and_si256(_mm256_srlv_epi32(_mm256_shuffle_epi8(bytes, pick), shifts),
+                                       _mm256_set1_epi32(63));
+    const __m256 f = _mm256_mul_ps(_mm256_cvtepi32_ps(_mm256_sub_epi32(q, zp)), s);
+    return _mm256_cvtps_ph(f, _MM_FROUND_TO_NEAREST_INT | _MM_FROUND_NO_EXC);
+}
+
+__attribute__((target("avx2,f16c")))
+static void dequant_row_avx2(const uint8_t* src, uint16_t* dst, int64_t packed,
+                             int8_t zero_point, float scale) {
+    const __m256i pick01 = _mm256_setr_epi8(0, 1, 2, -1, 0, 1, 2, -1, 0, 1, 2, -1, 0, 1, 2, -1,
+                                            3, 4, 5, -1, 3, 4, 5, -1, 3, 4, 5, -1, 3, 4, 5, -1);
+    const __m256i pick23 = _mm256_setr_epi8(6, 7, 8, -1, 6, 7, 8, -1, 6, 7, 8, -1, 6, 7, 8, -1,
+                                            9, 10, 11, -1, 9, 10, 11, -1, 9, 10, 11, -1, 9, 10, 11, -1);
+    const __m256i zp = _mm256_set1_epi32(zero_point);
+    const __m256 s = _mm256_set1_ps(scale);
+    int64_t i = 0;
+    for (; i + 12 <= packed; i += 12, src += 12, dst += 16) {
+        const __m256i bytes = _mm256_broadcastsi128_si256(load12(src, i + 16 > packed));
+        _mm_storeu_si128(reinterpret_cast<__m128i*>(dst), dequant8_avx2(bytes, pick01, zp, s));
+        _mm_storeu_si128(reinterpret_cast<__m128i*>(dst + 8), dequant8_avx2(bytes, pick23, zp, s));
+    }
+    dequant_row_scalar(src, dst, packed - i, zero_point, scale);
+}
+
+__attribute__((target("avx2,f16c,fma")))
+static float dot_avx2(const uint16_t* w, const float* x, int64_t n) {
+    __m256 acc0 = _mm256_setzero_ps(), acc1 = _mm256_setzero_ps();
+    int64_t i = 0;
+    for (; i + 16 <= n; i += 16) {
+        acc0 = _mm256_fmadd_ps(_mm256_cvtph_ps(_mm_loadu_si128(reinterpret_cast<const __m128i*>(w + i))),
+                               _mm256_loadu_ps(x + i), acc0);
+        acc1 = _mm256_fmadd_ps(_mm256_cvtph_ps(_mm_loadu_si128(reinterpret_cast<const __m128i*>(w + i + 8))),
+                               _mm256_loadu_ps(x + i + 8), acc1);
+    }
+    const __m256 acc = _mm256_add_ps(acc0, acc1);
+    __m128 sum = _mm_add_ps(_mm256_castps256_ps128(acc), _mm256_extractf128_ps(acc, 1));
+    sum = _mm_hadd_ps(sum, sum);
+    sum = _mm_hadd_ps(sum, sum);
+    return _mm_cvtss_f32(sum) + dot_scalar(w + i, x + i, n - i);
+}
+
+// 同 AVX2，但 512 位寄存器的 4 个 128 位通道各取一组，一次得到 16 个值
+__attribute__((target("avx512f,avx512bw")))
+static void dequant_row_avx512(const uint8_t* src, uint16_t* dst, int64_t packed,
+                               int8_t zero_point, float scale) {
+    const __m512i pick = _mm512_set_epi8(
+        -1, 11, 10, 9, -1, 11, 10, 9, -1, 11, 10, 9, -1, 11, 10, 9,
+        -1, 8, 7, 6, -1, 8, 7, 6, -1, 8, 7, 6, -1, 8, 7, 6,
+        -1, 5, 4, 3, -1, 5, 4, 3, -1, 5, 4, 3, -1, 5, 4, 3,
+        -1, 2, 1, 0, -1, 2, 1, 0, -1, 2, 1, 0, -1, 2, 1, 0);
+    const __m512i shifts = _mm512_set_epi32(18, 12, 6, 0, 18, 12, 6, 0, 18, 12, 6, 0, 18, 12, 6, 0);
+    const __m512i mask = _mm512_set1_epi32(63);
+    const __m512i zp = _mm512_set1_epi32(zero_point);
+    const __m512 s = _mm512_set1_ps(scale);
+    int64_t i = 0;
+    for (; i + 12 <= packed; i += 12, src += 12, dst += 16) {
+        const __m512i bytes = _mm512_broadcast_i32x4(load12(src, i + 16 > packed));
+        const __m512i q = _mm512_and_si512(_mm512_srlv_epi32(_mm512_shuffle_epi8(bytes, pick), shifts), mask);
+        const __m512 f = _mm512_mul_ps(_mm512_cvtepi32_ps(_mm512_sub_epi32(q, zp)), s);
+        _mm256_storeu_si256(reinterpret_cast<__m256i*>(dst),
+                            _mm512_cvtps_ph(f, _MM_FROUND_TO_NEAREST_INT | _MM_FROUND_NO_EXC));
+    }
+    dequant_row_scalar(src, dst, packed - i, zero_point, scale);
+}
+
+__attribute__((target("avx512f")))
+static float dot_avx512(const uint16_t* w, const float* x, int64_t n) {
+    __m512 acc0 = _mm512_setzero_ps(), acc1 = _mm512_setzero_ps();
+    int64_t i = 0;
+    for (; i + 32 <= n; i += 32) {
+        acc0 = _mm512_fmadd_ps(_mm512_cvtph_ps(_mm256_loadu_si256(reinterpret_cast<const __m256i*>(w + i))),
+                               _mm512_loadu_ps(x + i), acc0);
+        acc1 = _mm512_fmadd_ps(_mm512_cvtph_ps(_mm256_loadu_si256(reinterpret_cast<const __m256i*>(w + i + 16))),
+                               _mm512_loadu_ps(x + i + 16), acc1);
+    }
+    return _mm512_reduce_add_ps(_mm512_add_ps(acc0, acc1)) + dot_scalar(w + i, x + i, n - i);
+}
+
+static bool has_f16c() {
+    unsigned eax, ebx, ecx, edx;
+    return __get_cpuid(1, &eax, &ebx, &ecx, &edx) && (ecx & bit_F16C);
+}
+
+#elif defined(__aarch64__)
+
+static float dot_neon(const uint16_t* w, const float* x, int64_t n) {
+    float32x4_t acc0 = vdupq_n_f32(0), acc1 = vdupq_n_f32(0);
+    int64_t i = 0;
+    for (; i + 8 <= n; i += 8) {
+        const float16x8_t h = vreinterpretq_f16_u16(vld1q_u16(w + i));
+        acc0 = vfmaq_f32(acc0, vcvt_f32_f16(vget_low_f16(h)), vld1q_f32(x + i));
+        acc1 = vfmaq_f32(acc1, vcvt_high_f32_f16(h), vld1q_f32(x + i + 4));
+    }
+    return vaddvq_f32(vaddq_f32(acc0, acc1)) + dot_scalar(w + i, x + i, n - i);
+}
+
+static inline uint16x8_t dequant8_neon(uint8x8_t q, int16x8_t zp, float32x4_t s) {
+    const int16x8_t v = vsubq_s16(vreinterpretq_s16_u16(vmovl_u8(q)), zp);
+    const float32x4_t lo = vmulq_f32(vcvtq_f32_s32(vmovl_s16(vget_low_s16(v))), s);
+    const float32x4_t hi = vmulq_f32(vcvtq_f32_s32(vmovl_high_s16(v)), s);
+    return vreinterpretq_u16_f16(vcombine_f16(vcvt_f16_f32(lo), vcvt_f16_f32(hi)));
+}
+
+// vld3 按字节解交织 8 个 3 字节组，得到 4 路各 8 个值，vst4 再交织写回
+static void dequant_row_neon(const uint8_t* src, uint16_t* dst, int64_t packed,
+                             int8_t zero_point, float scale) {
+    const int16x8_t zp = vdupq_n_s16(zero_point);
+    const float32x4_t s = vdupq_n_f32(scale);
+    int64_t i = 0;
+    for (; i + 24 <= packed; i += 24, src += 24, dst += 32) {
+        const uint8x8x3_t b = vld3_u8(src);
+        uint16x8x4_t out;
+        out.val[0] = dequant8_neon(vand_u8(b.val[0], vdup_n_u8(0x3f)), zp, s);
+        out.val[1] = dequant8_neon(vorr_u8(vshl_n_u8(vand_u8(b.val[1], vdup_n_u8(0xf)), 2),
+                                           vshr_n_u8(b.val[0], 6)), zp, s);
+        out.val[2] = dequant8_neon(vorr_u8(vshl_n_u8(vand_u8(b.val[2], vdup_n_u8(0x3)), 4),
+                                           vshr_n_u8(b.val[1], 4)), zp, s);
+        out.val[3] = dequant8_neon(vshr_n_u8(b.val[2], 2), zp, s);
+        vst4q_u16(dst, out);
+    }
+    dequant_row_scalar(src, dst, packed - i, zero_point, scale);
+}
+
+#endif
+
+std::vector<DequantKernel> available_dequant_kernels() {
+    std::vector<DequantKernel> kernels;
+#if defined(__x86_64__)
+    __builtin_cpu_init();
+    if (__builtin_cpu_supports("avx512f") && __builtin_cpu_supports("avx512bw")) {
+        kernels.push_back({"avx512", dequant_row_avx512, dot_avx512});
+    }
+    if (__builtin_cpu_supports("avx2") && __builtin_cpu_supports("fma") && has_f16c()) {
+        kernels.push_back({"avx2", dequant_row_avx2, dot_avx2});
+    }
+#elif defined(__aarch64__)
+    // NEON 是 aarch64 的基础特性
+    kernels.push_back({"neon", dequant_row_neon, dot_neon});
+#endif
+    kernels.push_back({"scalar", dequant_row_scalar, dot_scalar});
+    return kernels;
+}
@@ -0,0 +1,25 @@
+#ifndef Q_6BIT_DEQUANT_KERNELS_H
+#define Q_6BIT_DEQUANT_KERNELS_H
+
+#include <cstdint>
+#include <vector>
+
+// 解量化一行（一个 group）：把 packed 个字节展开为 packed/3*4 个 6bit 值 q，写出
+// fp16((q - zero_point) * scale) 的位模式。q - zero_point 乘 fp16 的 scale 在 float
+// 中是精确的，只在转回 fp16 时舍入一次（就近偶数），所以各实现与 PyTorch 逐位一致
+using DequantRowFn = void (*)(const uint8_t* src, uint16_t* dst, int64_t packed,
+                              int8_t zero_point, float scale);
+
+// n 个 fp16（位模式）与 n 个 float 的点积，在 float 中累加
+using DotFn = float (*)(const uint16_t* w, const float* x, int64_t n);
+
+struct DequantKernel {
+    const char* name;
+    DequantRowFn row;
+    DotFn dot;
+};
+
+// 本机 CPU 支持的实现，从快到慢排列，最后一个总是 scalar
+std::vector<DequantKernel> available_dequant_kernels();
+
+#endif  // Q_6BIT_DEQUANT_KERNELS_H
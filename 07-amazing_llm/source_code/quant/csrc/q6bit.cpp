@@ -1,24 +1,344 @@
 #include "q6bit.h"
+#include "dequant_kernels.h"
 #include <torch/extension.h>
+#include <ATen/Parallel.h>
+#include <algorithm>
+#include <atomic>
+#include <cmath>
+#include <cstdlib>
 #include <iostream>
+#include <numeric>
+#include <vector>
+#include <sys/mman.h>
+
+// 解量化结果的版本：结果（而不只是实现）改变时加一，q6bit.cache 用它区分缓存
+constexpr int DEQUANT_VERSION = 1;
+
+// 每次并行任务至少处理的输出元素数，避免小张量的调度开销
+constexpr int64_t GRAIN_ELEMS = 1 << 16;
+
+// 3 个字节展开为 4 个 6bit 值（与 utils.unsqueeze_from_6bit 的布局一致）
+static inline void unpack_3bytes(const uint8_t* src, uint8_t* dst) {
+    const uint8_t b0 = src[0], b1 = src[1], b2 = src[2];
+    dst[0] = b0 & 0x3f;
+    dst[1] = ((b1 & 0xf) << 2) | (b0 >> 6);
+    dst[2] = ((b2 & 0x3) << 4) | (b1 >> 4);
+    dst[3] = b2 >> 2;
+}
+
+// 当前使用的解量化实现，导入时按 CPU 特性选择（见 select_dequant_kernel）
+static DequantKernel dequant_kernel = available_dequant_kernels().front();
+
+static void select_dequant_kernel(const std::string& name) {
+    for (const auto& kernel : available_dequant_kernels()) {
+        if (name == kernel.name) {
+            dequant_kernel = kernel;
+            return;
+        }
+    }
+    TORCH_CHECK(false, "dequant kernel ", name, " is not available on this CPU");
+}
+
+static std::vector<std::string> dequant_kernel_names() {
+    std::vector<std::string> names;
+    for (const auto& kernel : available_dequant_kernels()) {
+        names.push_back(kernel.name);
+    }
+    return names;
+}
+
+// unpack_3bytes 的逆：4 个 6bit 值打包为 3 个字节
+static inline void pack_4values(const uint8_t* src, uint8_t* dst) {
+    const uint32_t x = src[0] | src[1] << 6 | src[2] << 12 | src[3] << 18;
+    dst[0] = x & 0xff;
+    dst[1] = (x >> 8) & 0xff;
+    dst[2] = x >> 16;
+}
 
 at::Tensor unsqueeze_from_6bit(const at::Tensor& qweight){
-    return at::empty_like(qweight);
+    TORCH_CHECK(qweight.scalar_type() == at::kByte, "qweight must be uint8");
+    TORCH_CHECK(qweight.dim() >= 1 && qweight.size(-1) % 3 == 0,
+                "last dim of qweight must be a multiple of 3");
+    const at::Tensor q = qweight.contiguous();
+    auto shape = q.sizes().vec();
+    shape.back() = shape.back() / 3 * 4;
+    at::Tensor out = at::empty(shape, q.options());
+
+    const uint8_t* src = q.data_ptr<uint8_t>();
+    uint8_t* dst = out.data_ptr<uint8_t>();
+    at::parallel_for(0, q.numel() / 3, GRAIN_ELEMS / 4, [&](int64_t begin, int64_t end) {
+        for (int64_t i = begin; i < end; ++i) {
+            unpack_3bytes(src + 3 * i, dst + 4 * i);
+        }
+    });
+    return out;
+}
+
+// 一个待解量化的张量：连续化后的输入和输出（由调用者分配）
+struct DequantInput {
+    at::Tensor q, zp, sc, out;
+    std::vector<int64_t> shape;  // 输出形状 [..., X]
+    int64_t packed;  // 每个 group 的字节数
+    int64_t group;   // 每个 group 的元素数
+    int64_t rows;    // group 数
+};
+
+static DequantInput prepare_dequant(
+    const at::Tensor& quant_param,
+    const at::Tensor& zero_point,
+    const at::Tensor& scale
+) {
+    TORCH_CHECK(quant_param.scalar_type() == at::kByte, "qweight must be uint8");
+    TORCH_CHECK(zero_point.scalar_type() == at::kChar, "zero_point must be int8");
+    TORCH_CHECK(scale.scalar_type() == at::kHalf, "scales must be float16");
+    TORCH_CHECK(quant_param.dim() >= 2 && quant_param.size(-1) % 3 == 0,
+                "qweight must be [..., groups, group_size/4*3]");
+    DequantInput in;
+    in.q = quant_param.contiguous();
+    in.zp = zero_point.contiguous();
+    in.sc = scale.contiguous();
+    in.packed = in.q.size(-1);
+    in.group = in.packed / 3 * 4;
+    in.rows = in.packed ? in.q.numel() / in.packed : 0;
+    TORCH_CHECK(in.zp.numel() == in.rows && in.sc.numel() == in.rows,
+                "zero_point and scales must hold one value per group");
+
+    // [..., X//group_num, group_num] -> [..., X]
+    in.shape = in.q.sizes().vec();
+    in.shape.pop_back();
+    in.shape.back() *= in.group;
+    return in;
+}
+
+// arena 中每个输出的起点按 ARENA_ALIGN 个元素（128 字节）对齐，相邻张量的任务不共享缓存行
+constexpr int64_t ARENA_ALIGN = 64;
+constexpr size_t HUGE_PAGE = 2 << 20;
+
+// 一次分配 n 个 fp16：按 2MB 对齐并建议内核使用透明大页（不支持时照常用小页），
+// 缺页次数少得多；内存在第一次写入时由各工作线程分别触发缺页
+static at::Tensor alloc_half_arena(int64_t n) {
+    const size_t bytes = (n * sizeof(at::Half) + HUGE_PAGE - 1) / HUGE_PAGE * HUGE_PAGE;
+    if (bytes == 0) {
+        return at::empty({n}, at::TensorOptions().dtype(at::kHalf));
+    }
+    void* ptr = nullptr;
+    TORCH_CHECK(posix_memalign(&ptr, HUGE_PAGE, bytes) == 0,
+                "cannot allocate ", bytes, " bytes for dequantized weights");
+#ifdef MADV_HUGEPAGE
+    madvise(ptr, bytes, MADV_HUGEPAGE);
+#endif
+    return at::from_blob(ptr, {n}, [](void* p) { free(p); }, at::TensorOptions().dtype(at::kHalf));
+}
+
+// 一个并行任务：某个张量的 [begin, end) 行
+struct DequantTask {
+    const DequantInput* in;
+    int64_t begin, end;
+
+    void run() const {
+        const uint8_t* src = in->q.data_ptr<uint8_t>();
+        const int8_t* zps = in->zp.data_ptr<int8_t>();
+        const at::Half* scs = in->sc.data_ptr<at::Half>();
+        uint16_t* dst = reinterpret_cast<uint16_t*>(in->out.data_ptr<at::Half>());
+        const DequantRowFn row = dequant_kernel.row;
+        for (int64_t r = begin; r < end; ++r) {
+            row(src + r * in->packed, dst + r * in->group, in->packed, zps[r], static_cast<float>(scs[r]));
+        }
+    }
+};
+
+// 把每个张量切成约 GRAIN_ELEMS 个元素的任务，大张量在前，小张量各成一个任务排在后面
+// 填补空隙；torch 线程池（线程数由 vllm 绑核时设置）中的每个线程动态领取任务
+static void run_dequant(const std::vector<DequantInput>& inputs) {
+    std::vector<size_t> order(inputs.size());
+    std::iota(order.begin(), order.end(), 0);
+    std::stable_sort(order.begin(), order.end(), [&](size_t a, size_t b) {
+        return inputs[a].rows * inputs[a].group > inputs[b].rows * inputs[b].group;
+    });
+    std::vector<DequantTask> tasks;
+    for (size_t i : order) {
+        const DequantInput& in = inputs[i];
+        const int64_t step = std::max<int64_t>(1, GRAIN_ELEMS / std::max<int64_t>(1, in.group));
+        for (int64_t r = 0; r < in.rows; r += step) {
+            tasks.push_back({&in, r, std::min(r + step, in.rows)});
+        }
+    }
+
+    std::atomic<size_t> next{0};
+    const int64_t workers = std::min<int64_t>(at::get_num_threads(), tasks.size());
+    at::parallel_for(0, workers, 1, [&](int64_t, int64_t) {
+        for (size_t t; (t = next.fetch_add(1, std::memory_order_relaxed)) < tasks.size();) {
+            tasks[t].run();
+        }
+    });
 }
 
 at::Tensor calculate_dequant(
-    const at::Tensor& quant_param, 
-    const at::Tensor& zero_point, 
+    const at::Tensor& quant_param,
+    const at::Tensor& zero_point,
+    const at::Tensor& scale
+) {
+    std::vector<DequantInput> inputs{prepare_dequant(quant_param, zero_point, scale)};
+    inputs[0].out = at::empty(inputs[0].shape, inputs[0].q.options().dtype(at::kHalf));
+    run_dequant(inputs);
+    return inputs[0].out;
+}
+
+std::vector<at::Tensor> calculate_dequant_batch(
+    const std::vector<at::Tensor>& quant_params,
+    const std::vector<at::Tensor>& zero_points,
+    const std::vector<at::Tensor>& scales
+) {
+    TORCH_CHECK(quant_params.size() == zero_points.size() && quant_params.size() == scales.size(),
+                "need one zero_point and scales per qweight");
+    std::vector<DequantInput> inputs;
+    inputs.reserve(quant_params.size());
+    for (size_t i = 0; i < quant_params.size(); ++i) {
+        inputs.push_back(prepare_dequant(quant_params[i], zero_points[i], scales[i]));
+    }
+
+    // 所有输出放进同一块 arena，各自是其中的一个视图
+    std::vector<int64_t> offsets;
+    int64_t total = 0;
+    for (const auto& in : inputs) {
+        offsets.push_back(total);
+        total += (in.rows * in.group + ARENA_ALIGN - 1) / ARENA_ALIGN * ARENA_ALIGN;
+    }
+    const at::Tensor arena = alloc_half_arena(total);
+    for (size_t i = 0; i < inputs.size(); ++i) {
+        inputs[i].out = arena.narrow(0, offsets[i], inputs[i].rows * inputs[i].group).view(inputs[i].shape);
+    }
+    run_dequant(inputs);
+
+    std::vector<at::Tensor> outs;
+    outs.reserve(inputs.size());
+    for (auto& in : inputs) {
+        outs.push_back(std::move(in.out));
+    }
+    return outs;
+}
+
+// 把 [..., X] 的权重按 group_size 个一组量化为 calculate_dequant 的输入：
+// qweight [..., X//group_size, group_size/4*3], zero_point/scales [..., X//group_size, 1]。
+// 每组的范围取 [min(w, 0), max(w, 0)]，scale 为范围的 1/63（存为 fp16），
+// zero_point = round(-min/scale) 总在 [0, 63] 内，q = clamp(round(w/scale) + zero_point, 0, 63)
+std::vector<at::Tensor> quantize_to_6bit(const at::Tensor& weight, int64_t group_size) {
+    TORCH_CHECK(group_size > 0 && group_size % 4 == 0, "group_size must be a positive multiple of 4");
+    TORCH_CHECK(weight.dim() >= 1 && weight.size(-1) % group_size == 0,
+                "last dim of weight must be a multiple of group_size");
+    const at::Tensor w = weight.to(at::kFloat).contiguous();
+    auto shape = w.sizes().vec();
+    shape.back() /= group_size;
+    const int64_t rows = w.numel() / group_size, packed = group_size / 4 * 3;
+    shape.push_back(packed);
+    at::Tensor qweight = at::empty(shape, w.options().dtype(at::kByte));
+    shape.back() = 1;
+    at::Tensor zero_point = at::empty(shape, w.options().dtype(at::kChar));
+    at::Tensor scales = at::empty(shape, w.options().dtype(at::kHalf));
+
+    const float* src = w.data_ptr<float>();
+    uint8_t* dst = qweight.data_ptr<uint8_t>();
+    int8_t* zps = zero_point.data_ptr<int8_t>();
+    at::Half* scs = scales.data_ptr<at::Half>();
+    at::parallel_for(0, rows, std::max<int64_t>(1, GRAIN_ELEMS / group_size), [&](int64_t begin, int64_t end) {
+        std::vector<uint8_t> q(group_size);
+        for (int64_t r = begin; r < end; ++r) {
+            const float* g = src + r * group_size;
+            float lo = 0, hi = 0;
+            for (int64_t i = 0; i < group_size; ++i) {
+                lo = std::min(lo, g[i]);
+                hi = std::max(hi, g[i]);
+            }
+            // 全零的组 scale 取 1
+            at::Half scale_h = (hi - lo) / 63;
+            if (!(static_cast<float>(scale_h) > 0)) {
+                scale_h = 1.0f;
+            }
+            const float scale = scale_h;
+            const float zp = std::nearbyint(-lo / scale);
+            for (int64_t i = 0; i < group_size; ++i) {
+                q[i] = static_cast<uint8_t>(std::clamp(std::nearbyint(g[i] / scale) + zp, 0.0f, 63.0f));
+            }
+            for (int64_t i = 0; i < group_size; i += 4) {
+                pack_4values(q.data() + i, dst + r * packed + i / 4 * 3);
+            }
+            zps[r] = static_cast<int8_t>(zp);
+            scs[r] = scale_h;
+        }
+    });
+    return {qweight, zero_point, scales};
+}
+
+// 每次并行任务至少处理的权重行数
+constexpr int64_t GEMV_GRAIN_ROWS = 16;
+
+// y = x @ W^T，W [N, K] 直接由 6bit 的 qweight/zero_point/scales 给出：每个线程把一行权重
+// 解量化到留在 L1 中的缓冲区里，立即与 x 的每一行做点积，fp16 的 W 从不整块展开。
+// 权重只被读一遍，适合解码时的小批量 x；结果按 fp16 的 W 计算，只是累加顺序与 matmul 不同
+at::Tensor gemv_6bit(
+    const at::Tensor& x,
+    const at::Tensor& quant_param,
+    const at::Tensor& zero_point,
     const at::Tensor& scale
 ) {
-    return at::empty_like(quant_param);
+    const DequantInput w = prepare_dequant(quant_param, zero_point, scale);
+    TORCH_CHECK(w.shape.size() == 2 && w.packed > 0,
+                "qweight must be [N, K//group_size, group_size/4*3]");
+    const int64_t n = w.shape[0], k = w.shape[1], groups = k / w.group;
+    TORCH_CHECK(x.dim() >= 1 && x.size(-1) == k, "last dim of x must be ", k);
+    const at::Tensor xf = x.reshape({-1, k}).to(at::kFloat).contiguous();
+    const int64_t m = xf.size(0);
+    at::Tensor out = at::empty({m, n}, xf.options());
+
+    const uint8_t* src = w.q.data_ptr<uint8_t>();
+    const int8_t* zps = w.zp.data_ptr<int8_t>();
+    const at::Half* scs = w.sc.data_ptr<at::Half>();
+    const float* xs = xf.data_ptr<float>();
+    float* dst = out.data_ptr<float>();
+    const DequantKernel kernel = dequant_kernel;
+    at::parallel_for(0, n, GEMV_GRAIN_ROWS, [&](int64_t begin, int64_t end) {
+        std::vector<uint16_t> row(k);
+        for (int64_t j = begin; j < end; ++j) {
+            for (int64_t g = 0, r = j * groups; g < groups; ++g, ++r) {
+                kernel.row(src + r * w.packed, row.data() + g * w.group, w.packed, zps[r],
+                           static_cast<float>(scs[r]));
+            }
+            for (int64_t i = 0; i < m; ++i) {
+                dst[i * n + j] = kernel.dot(row.data(), xs + i * k, k);
+            }
+        }
+    });
+
+    auto shape = x.sizes().vec();
+    shape.back() = n;
+    return out.to(x.scalar_type()).view(shape);
 }
 
 
 // 绑定到Python
 PYBIND11_MODULE(_C, m) {
-    m.def("unsqueeze_from_6bit", &unsqueeze_from_6bit, 
-        "unsqueeze from 6bit");
+    // 默认用最快的实现；可用环境变量 Q6BIT_KERNEL 指定（如 scalar）
+    if (const char* name = std::getenv("Q6BIT_KERNEL")) {
+        select_dequant_kernel(name);
+    }
+    m.attr("DEQUANT_VERSION") = DEQUANT_VERSION;
+    m.def("unsqueeze_from_6bit", &unsqueeze_from_6bit,
+        "unsqueeze from 6bit", py::call_guard<py::gil_scoped_release>());
     m.def("calculate_dequant", &calculate_dequant,
-        "calculate dequant");
+        "calculate dequant", py::call_guard<py::gil_scoped_release>());
+    m.def("calculate_dequant_batch", &calculate_dequant_batch,
+        "calculate dequant of several weights at once, balanced over the threads",
+        py::call_guard<py::gil_scoped_release>());
+    m.def("quantize_to_6bit", &quantize_to_6bit,
+        "quantize to the qweight, zero_point and scales calculate_dequant takes",
+        py::arg("weight"), py::arg("group_size") = 128, py::call_guard<py::gil_scoped_release>());
+    m.def("gemv_6bit", &gemv_6bit,
+        "x @ W^T with W given by its 6bit qweight, zero_point and scales",
+        py::call_guard<py::gil_scoped_release>());
+    m.def("dequant_kernels", &dequant_kernel_names,
+        "dequant kernels this CPU supports, fastest first");
+    m.def("get_dequant_kernel", [] { return std::string(dequant_kernel.name); },
+        "name of the dequant kernel in use");
+    m.def("set_dequant_kernel", &select_dequant_kernel,
+        "use the named dequant kernel");
 }
@@ -2,6 +2,7 @@
 #define Q_6BIT_H
 
 #include <torch/script.h>
+#include <vector>
 
 at::Tensor unsqueeze_from_6bit(const at::Tensor& qweight);
 at::Tensor calculate_dequant(
@@ -9,5 +10,17 @@ at::Tensor calculate_dequant(
     const at::Tensor& zero_point,
     const at::Tensor& scale
 );
+std::vector<at::Tensor> calculate_dequant_batch(
+    const std::vector<at::Tensor>& qweights,
+    const std::vector<at::Tensor>& zero_points,
+    const std::vector<at::Tensor>& scales
+);
+std::vector<at::Tensor> quantize_to_6bit(const at::Tensor& weight, int64_t group_size);
+at::Tensor gemv_6bit(
+    const at::Tensor& x,
+    const at::Tensor& qweight,
+    const at::Tensor& zero_point,
+    const at::Tensor& scale
+);
 
 #endif  // Q_6BIT_H
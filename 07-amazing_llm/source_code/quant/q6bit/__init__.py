@@ -1 +1,2 @@
-from .utils import recover_from_quant
+from .cfunc import c_recover_from_quant as recover_from_quant, c_recover_from_quant_iter as recover_from_quant_iter, c_gemv_6bit as gemv_6bit, c_quantize_to_6bit as quantize_to_6bit, c_recover_from_quant_cached as recover_from_quant_cached
+from .lazy import LazyWeight, recover_from_quant_lazy
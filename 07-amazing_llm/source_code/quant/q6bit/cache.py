@@ -0,0 +1,137 @@
+'''
+opt-in disk cache of recovered weights, so a restarted server maps the fp16 weights back
+in instead of dequantizing the checkpoint again:
+
+    Q6BIT_CACHE=/tmp/q6bit-cache vllm serve ...
+
+With Q6BIT_CACHE set, `recover_from_quant` (what vLLM calls) keys the cache by
+`tensors_key` of the tensors it is given; `recover_from_quant_cached` keys it by
+`checkpoint_key` of the safetensors files instead, for callers that know them.
+
+Each key is stored as <key>.fp16: the magic, the length of a JSON index, the index
+([name, dtype, shape, offset] per tensor) and the tensors, each 64-byte aligned at its
+offset from the end of the index. Both keys include DEQUANT_VERSION of the extension, so
+a changed dequant gets a new file. The file is mapped copy-on-write: the weights share the
+page cache and nothing is read until it is touched.
+
+The run that fills the cache also writes every fp16 weight to disk, so it is slower than
+one without the cache; with the evaluation's cold-start limit measured against the fast
+cached runs, keep it off for scored runs.
+'''
+import hashlib, json, mmap, os, struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Union
+import torch
+from ._C import DEQUANT_VERSION
+
+CACHE_DIR = os.environ.get("Q6BIT_CACHE")
+
+MAGIC = b"Q6BITFP\x01"
+U64 = struct.Struct("<Q")
+ALIGN = 64
+# bytes of a tensor hashed as one piece of tensors_key; the pieces are hashed in parallel
+KEY_CHUNK = 1 << 26
+
+def checkpoint_files(checkpoint: Union[str, Iterable[str]]) -> list[str]:
+    '''the safetensors files of a checkpoint directory, or the given files'''
+    if isinstance(checkpoint, str) and os.path.isdir(checkpoint):
+        return sorted(os.path.join(checkpoint, i) for i in os.listdir(checkpoint) if i.endswith('.safetensors'))
+    return sorted([checkpoint] if isinstance(checkpoint, str) else checkpoint)
+
+def checkpoint_key(checkpoint: Union[str, Iterable[str]]) -> str:
+    '''
+    hash of the checkpoint files and DEQUANT_VERSION; safetensors headers hold every tensor's
+    dtype, shape and offsets, so the weights themselves are not read
+    '''
+    h = hashlib.sha256(f"q6bit {DEQUANT_VERSION}".encode())
+    for path in checkpoint_files(checkpoint):
+        st = os.stat(path)
+        with open(path, "rb") as f:
+            head = f.read(U64.size)
+            header = f.read(U64.unpack(head)[0]) if len(head) == U64.size else head
+        h.update(f"{os.path.basename(path)} {st.st_size} {st.st_mtime_ns}\n".encode())
+        h.update(header)
+    return h.hexdigest()[:32]
+
+def tensors_key(qweight_lst: list[tuple[str, torch.Tensor]]) -> str:
+    '''
+    hash of everything `recover_from_quant` is given: every name, dtype, shape and byte of
+    each tensor, and DEQUANT_VERSION. hashlib releases the GIL, so the KEY_CHUNK pieces are
+    hashed on torch's threads and their digests hashed in order
+    '''
+    qweight_lst = sorted(qweight_lst, key=lambda x: x[0])
+    views = [memoryview(ti.contiguous().reshape(-1).view(torch.uint8).numpy()) for _, ti in qweight_lst]
+    chunks = [[v[i:i + KEY_CHUNK] for i in range(0, len(v), KEY_CHUNK)] for v in views]
+    with ThreadPoolExecutor(torch.get_num_threads()) as pool:
+        digests = pool.map(lambda c: hashlib.sha256(c).digest(), [c for ci in chunks for c in ci])
+        h = hashlib.sha256(f"q6bit {DEQUANT_VERSION}".encode())
+        for (namei, ti), ci in zip(qweight_lst, chunks):
+            h.update(f"{namei} {ti.dtype} {tuple(ti.shape)} {len(ci)}\n".encode())
+            for _ in ci:
+                h.update(next(digests))
+    return h.hexdigest()[:32]
+
+def cache_path(key: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, f"{key}.fp16")
+
+def aligned(n: int) -> int:
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+def nbytes(t: torch.Tensor) -> int:
+    return t.numel() * t.element_size()
+
+def load(path: str) -> list[tuple[str, torch.Tensor]]:
+    '''the tensors stored in `path`, as views into a private mapping of it'''
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    if len(mm) < len(MAGIC) + U64.size or mm[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a q6bit cache")
+    index_len, = U64.unpack_from(mm, len(MAGIC))
+    start = aligned(len(MAGIC) + U64.size + index_len)
+    index = json.loads(mm[len(MAGIC) + U64.size:len(MAGIC) + U64.size + index_len])
+    res_lst = []
+    for namei, dtypei, shapei, offseti in index:
+        dtype = getattr(torch, dtypei)
+        numel = 1
+        for d in shapei:
+            numel *= d
+        if start + offseti + numel * dtype.itemsize > len(mm):
+            raise ValueError(f"{path} is truncated")
+        ti = torch.frombuffer(mm, dtype=dtype, count=numel, offset=start + offseti) if numel else torch.empty(0, dtype=dtype)
+        res_lst.append((namei, ti.view(shapei)))
+    return res_lst
+
+def store(path: str, res_lst: list[tuple[str, torch.Tensor]]):
+    # filled under a temporary name: `path` only ever names a complete file, which load maps
+    index, offset = [], 0
+    for namei, ti in res_lst:
+        index.append([namei, str(ti.dtype).removeprefix("torch."), list(ti.shape), offset])
+        offset = aligned(offset + nbytes(ti))
+    head = json.dumps(index).encode()
+    start = aligned(len(MAGIC) + U64.size + len(head))
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb+") as f:
+        f.truncate(start + offset)
+        with mmap.mmap(f.fileno(), start + offset) as mm:
+            mm[:len(MAGIC) + U64.size + len(head)] = MAGIC + U64.pack(len(head)) + head
+            for (_, ti), (_, _, _, offseti) in zip(res_lst, index):
+                if ti.numel():
+                    out = torch.frombuffer(mm, dtype=torch.uint8, count=nbytes(ti), offset=start + offseti)
+                    out.copy_(ti.contiguous().view(-1).view(torch.uint8))
+                    del out
+            mm.flush()
+    os.replace(tmp, path)
+
+def cached(key: str, cache_dir: str, recover: Callable[[], list[tuple[str, torch.Tensor]]]) -> list[tuple[str, torch.Tensor]]:
+    '''the tensors cached under `key`, or those `recover` returns, stored under `key`'''
+    path = cache_path(key, cache_dir)
+    if os.path.exists(path):
+        try:
+            return load(path)
+        except ValueError as e:
+            print(f"q6bit cache: {e}, recovering again")
+    res_lst = recover()
+    store(path, res_lst)
+    return res_lst
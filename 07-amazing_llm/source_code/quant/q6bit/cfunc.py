@@ -1,29 +1,133 @@
-from ._C import unsqueeze_from_6bit, calculate_dequant
+from ._C import unsqueeze_from_6bit, calculate_dequant, calculate_dequant_batch, gemv_6bit, quantize_to_6bit
 import torch
-from tqdm import tqdm
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional, Union
+from . import cache
+def split_name(namei: str) -> Optional[tuple[str, str]]:
+    '''(X, part) of a quantized tensor named `X.part`, or None for a norm weight, which is kept as it is'''
+    if 'norm' in namei:
+        return None
+    ki, _, parti = namei.rpartition('.')
+    return ki, parti
+
 def c_unsqueeze_from_6bit(qweight: torch.Tensor) -> torch.Tensor:
     return unsqueeze_from_6bit(qweight)
 
 def c_calculate_dequant(quant_param: torch.Tensor, zero_point: torch.Tensor, scale: torch.Tensor) -> torch.Tensor:
     return calculate_dequant(quant_param, zero_point, scale)
 
+def c_quantize_to_6bit(weight: torch.Tensor, group_size: int = 128) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    '''
+    weight [..., X] -> (qweight [..., X//group_size, group_size//4*3], zero_point, scales [..., X//group_size, 1]),
+    the layout `c_calculate_dequant` takes; for synthetic checkpoints
+    '''
+    qweight, zero_point, scales = quantize_to_6bit(weight, group_size)
+    return qweight, zero_point, scales
+
+def c_gemv_6bit(x: torch.Tensor, qweight: torch.Tensor, zero_point: torch.Tensor, scales: torch.Tensor) -> torch.Tensor:
+    '''
+    x [..., K] @ W^T, W [N, K] recovered from qweight [N, K//group_num, group_num//4*3] tile by tile
+    without being expanded; for the few rows of x in decoding
+    '''
+    return gemv_6bit(x, qweight, zero_point, scales)
+
 def c_recover_from_quant(qweight_lst : list[tuple[str, torch.Tensor]]) -> list[tuple[str, torch.Tensor]]:
     '''
     a weight named `X` will be recoverd from `X.qweight`(uint8), `X.zero_point`(int8) and `X.scales`(float16)
+
+    with $Q6BIT_CACHE set the results are kept in that directory and mapped back in when the
+    same weights are recovered again, see cache.py
     '''
+    if cache.CACHE_DIR is not None:
+        return cache.cached(cache.tensors_key(qweight_lst), cache.CACHE_DIR, lambda: c_recover(qweight_lst))
+    return c_recover(qweight_lst)
+
+def c_recover(qweight_lst : list[tuple[str, torch.Tensor]]) -> list[tuple[str, torch.Tensor]]:
+    '''`c_recover_from_quant` without the cache'''
     key_set = set()
     qweight_dic = {}
     res_lst = []
     for namei, ti in qweight_lst:
-        if 'norm' not in namei:
-            key_set.add(namei[:namei.rfind('.')])
+        key = split_name(namei)
+        if key is not None:
+            key_set.add(key[0])
             qweight_dic[namei] = ti
         else:
             res_lst.append((namei, ti))
     
-    for ki in tqdm(key_set):
-        qweighti = qweight_dic[ki+".qweight"]
-        zero_pointi = qweight_dic[ki+".zero_point"]
-        scalesi = qweight_dic[ki+".scales"]
-        res_lst.append((ki, c_calculate_dequant(qweighti, zero_pointi, scalesi)))
-    return res_lst
\ No newline at end of file
+    # one native call for every weight: it splits them into similar-sized tasks, largest
+    # weights first, and balances those over all threads with the GIL released; the
+    # results are views into one fp16 allocation
+    key_lst = list(key_set)
+    deq_lst = calculate_dequant_batch([qweight_dic[ki+".qweight"] for ki in key_lst],
+                                      [qweight_dic[ki+".zero_point"] for ki in key_lst],
+                                      [qweight_dic[ki+".scales"] for ki in key_lst])
+    res_lst.extend(zip(key_lst, deq_lst))
+    return res_lst
+
+def c_dequant_batch(qweight_dic_lst: list[tuple[str, dict[str, torch.Tensor]]]) -> list[tuple[str, torch.Tensor]]:
+    '''
+    dequantize [(X, {'qweight': .., 'zero_point': .., 'scales': ..}), ...] in one native call
+    '''
+    deq_lst = calculate_dequant_batch([parts['qweight'] for _, parts in qweight_dic_lst],
+                                      [parts['zero_point'] for _, parts in qweight_dic_lst],
+                                      [parts['scales'] for _, parts in qweight_dic_lst])
+    return [(ki, deq) for (ki, _), deq in zip(qweight_dic_lst, deq_lst)]
+
+def c_recover_from_quant_iter(qweight_iter: Iterable[tuple[str, torch.Tensor]],
+                              batch_numel: int = 1 << 26) -> Iterator[tuple[str, torch.Tensor]]:
+    '''
+    streaming `c_recover_from_quant`: consumes (name, tensor) pairs as they are read and yields
+    the recovered ones, not in input order.
+
+    A weight is queued as soon as its `X.qweight`, `X.zero_point` and `X.scales` have all
+    arrived; once the queued weights hold `batch_numel` quantized bytes they are dequantized
+    on a background thread (which releases the GIL) while reading goes on and the previous
+    batch is yielded, and the quantized sources are dropped as soon as that batch is done.
+    '''
+    partial: dict[str, dict[str, torch.Tensor]] = {}
+    queued: list[tuple[str, dict[str, torch.Tensor]]] = []
+    queued_numel = 0
+    running: Optional[Future] = None
+    with ThreadPoolExecutor(1) as pool:
+        for namei, ti in qweight_iter:
+            key = split_name(namei)
+            if key is None:
+                yield namei, ti
+                continue
+            ki, parti = key
+            parts = partial.setdefault(ki, {})
+            parts[parti] = ti
+            if len(parts) < 3:
+                continue
+            queued.append((ki, partial.pop(ki)))
+            queued_numel += parts['qweight'].numel()
+            if queued_numel >= batch_numel:
+                # start this batch before handing out the last one, so it runs meanwhile
+                done, running = running, pool.submit(c_dequant_batch, queued)
+                queued, queued_numel = [], 0
+                if done is not None:
+                    yield from done.result()
+        if queued:
+            done, running = running, pool.submit(c_dequant_batch, queued)
+            if done is not None:
+                yield from done.result()
+        if running is not None:
+            yield from running.result()
+    if partial:
+        missing = [f"{ki}.{parti}" for ki, parts in partial.items()
+                   for parti in ('qweight', 'zero_point', 'scales') if parti not in parts]
+        raise KeyError(f"incomplete quantized weights, missing {', '.join(missing[:4])}")
+
+def c_recover_from_quant_cached(qweight_iter: Iterable[tuple[str, torch.Tensor]],
+                                checkpoint: Union[str, Iterable[str]],
+                                cache_dir: Optional[str] = cache.CACHE_DIR) -> list[tuple[str, torch.Tensor]]:
+    '''
+    `c_recover_from_quant_iter` through the cache in `cache_dir` (default $Q6BIT_CACHE, no cache
+    if unset), keyed by the checkpoint: `checkpoint` is the directory or the safetensors files
+    `qweight_iter` is read from. On a hit `qweight_iter` is not consumed, so it may be a lazy reader
+    '''
+    if cache_dir is None:
+        return list(c_recover_from_quant_iter(qweight_iter))
+    return cache.cached(cache.checkpoint_key(checkpoint), cache_dir,
+                        lambda: list(c_recover_from_quant_iter(qweight_iter)))
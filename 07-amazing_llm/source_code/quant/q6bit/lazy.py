@@ -0,0 +1,128 @@
+'''
+lazy `recover_from_quant`, for callers that call it directly: every weight is returned at
+once as a `LazyWeight`, a tensor that is only dequantized when its data is first used; with
+`ahead` a background thread also dequantizes them in checkpoint order, and a weight needed
+before the thread got to it is dequantized right away by whoever needs it.
+
+`recover_from_quant` itself stays eager. vLLM's weight loaders copy each weight into its
+parameter (`param.data.copy_(w)`) while loading, which forces every LazyWeight before the
+server listens, so the dequant would only move out of the timed call, not out of startup.
+The background thread runs a full team of torch threads next to the caller's.
+'''
+import threading
+from typing import Union
+import torch
+from ._C import calculate_dequant_batch
+from .cfunc import split_name
+
+def unwrap(a):
+    '''`a` with every LazyWeight in it (also inside lists, tuples and dicts) replaced by its data'''
+    if isinstance(a, LazyWeight):
+        return a.tensor()
+    if isinstance(a, (list, tuple)):
+        return type(a)(unwrap(x) for x in a)
+    if isinstance(a, dict):
+        return {k: unwrap(v) for k, v in a.items()}
+    return a
+
+class LazyWeight(torch.Tensor):
+    '''
+    the fp16 weight recovered from `qweight`, `zero_point` and `scales` on first use. Shape,
+    dtype and device are known without dequantizing; any operation on it uses the data
+    '''
+    @staticmethod
+    def __new__(cls, qweight: torch.Tensor, zero_point: torch.Tensor, scales: torch.Tensor,
+                dequantizer: "Dequantizer"):
+        shape = (*qweight.shape[:-2], qweight.shape[-2] * qweight.shape[-1] // 3 * 4)
+        self = torch.Tensor._make_wrapper_subclass(cls, shape, dtype=torch.float16, device=qweight.device)
+        self._parts = (qweight, zero_point, scales)
+        self._recovered = None
+        self._dequantizer = dequantizer
+        return self
+
+    @property
+    def ready(self) -> bool:
+        return self._recovered is not None
+
+    def tensor(self) -> torch.Tensor:
+        '''the recovered weight, dequantized now if no one has done it yet'''
+        if self._recovered is None:
+            self._dequantizer.force(self)
+        return self._recovered
+
+    # shape, dtype and other metadata come from the wrapper; only aten ops (below) need the data
+    __torch_function__ = torch._C._disabled_torch_function_impl
+
+    @classmethod
+    def __torch_dispatch__(cls, func, types, args=(), kwargs=None):
+        return func(*unwrap(args), **unwrap(kwargs or {}))
+
+    def __repr__(self) -> str:
+        return f"LazyWeight(shape={tuple(self.shape)}, ready={self.ready})"
+
+class Dequantizer:
+    '''
+    dequantizes a set of LazyWeights one native call at a time, so on-demand and ahead-of-use
+    work never run two thread teams on the same cores at once
+    '''
+    def __init__(self, batch_numel: int):
+        self.weights: list[LazyWeight] = []
+        self.batch_numel = batch_numel
+        self.next = 0
+        self.lock = threading.Lock()
+
+    def run(self, batch: list[LazyWeight]):
+        # under self.lock
+        deq_lst = calculate_dequant_batch(*map(list, zip(*(wi._parts for wi in batch))))
+        for wi, deq in zip(batch, deq_lst):
+            wi._recovered, wi._parts = deq, None
+
+    def force(self, weight: LazyWeight):
+        with self.lock:
+            if weight._recovered is None:
+                self.run([weight])
+
+    def prefetch(self):
+        '''dequantize the weights in order, `batch_numel` quantized bytes per call'''
+        while True:
+            with self.lock:
+                batch, numel = [], 0
+                while self.next < len(self.weights) and numel < self.batch_numel:
+                    wi = self.weights[self.next]
+                    self.next += 1
+                    if wi._recovered is None:
+                        batch.append(wi)
+                        numel += wi._parts[0].numel()
+                if not batch:
+                    return
+                self.run(batch)
+
+def recover_from_quant_lazy(qweight_lst: list[tuple[str, torch.Tensor]], ahead: bool = False,
+                            batch_numel: int = 1 << 26) -> list[tuple[str, Union[torch.Tensor, LazyWeight]]]:
+    '''
+    `recover_from_quant` returning a `LazyWeight` per weight, in the order the weights were
+    read; with `ahead` they are dequantized in that order on a daemon thread
+    '''
+    parts: dict[str, dict[str, torch.Tensor]] = {}
+    res_lst = []
+    for namei, ti in qweight_lst:
+        key = split_name(namei)
+        if key is None:
+            res_lst.append((namei, ti))
+            continue
+        ki, parti = key
+        if ki not in parts:
+            parts[ki] = {}
+            res_lst.append((ki, None))
+        parts[ki][parti] = ti
+
+    dequantizer = Dequantizer(batch_numel)
+    for i, (ki, ti) in enumerate(res_lst):
+        if ti is None:
+            pi = parts[ki]
+            wi = LazyWeight(pi['qweight'], pi['zero_point'], pi['scales'], dequantizer)
+            dequantizer.weights.append(wi)
+            res_lst[i] = (ki, wi)
+    if ahead:
+        threading.Thread(target=dequantizer.prefetch, name="q6bit-prefetch", daemon=True).start()
+    return res_lst
@@ -1,50 +1,223 @@
+#!/usr/bin/env python
+'''
+dequant benchmarks of the installed q6bit, on a synthetic Qwen3-8B-shaped checkpoint
+(default) or on a real one:
+
+    python speed_test.py [--checkpoint DIR] [--bind 0-31] [--threads 1,16,32] [-o speed_test.json]
+
+"recover" times recover_from_quant over the whole checkpoint as the evaluation does. The cold
+run is the first parallel op of a fresh process that only loaded the checkpoint (a synthetic
+one is saved to a temporary directory for it); here, after one untimed run, --repeat warm
+runs are averaged into t_avg, and the cold run is held to max(1.5 * t_avg, t_avg + 1.5).
+"kernels" then times calculate_dequant of each weight shape with every kernel and thread
+count; GB/s counts the packed bytes read and the fp16 bytes written. The JSON report carries
+the commit, so runs can be compared over time.
+'''
+import argparse, hashlib, json, os, subprocess, sys, tempfile, time
+from typing import Optional
 import torch
-from tqdm import tqdm
-import time
-import os
-from safetensors import safe_open
-import sys
-import hashlib
-def calculate_sha256(input_string):
-    # 将字符串转换为字节（使用UTF-8编码）
-    byte_data = input_string.encode('utf-8')
-    
-    # 创建SHA-256哈希对象并更新
-    sha256_hash = hashlib.sha256()
-    sha256_hash.update(byte_data)
-    
-    # 获取十六进制表示的哈希值
-    return sha256_hash.hexdigest()
-
-if len(sys.argv) != 2:
-     print(f"Usage: python {sys.argv[0]} <bound_core>\nex.\tpython {sys.argv[0]} 0-31")
-     exit(2)
-bound_core = sys.argv[1]
-print(f"will bound to {bound_core}")
-
-from vllm.v1.worker.gpu_worker import init_worker_distributed_environment
-ret = torch.ops._C_utils.init_cpu_threads_env(bound_core)
-if ret:
-    print(ret)
-
-res_lst : list[tuple[str, torch.Tensor]] = []
-model_path = os.path.expanduser('/lustre/share/xflops/amazing_llm/qwen3-8b-m3/')
-hf_weights_files = [os.path.join(model_path, i) for i in os.listdir(model_path)
-                    if i.endswith('.safetensors')]
-for st_file in tqdm(
-        hf_weights_files,
-        desc="Loading safetensors checkpoint shards",
-):
-    with safe_open(st_file, framework="pt") as f:
-        res_lst.extend([(namei, f.get_tensor(namei).detach().clone()) for namei in f.keys()])
-dequant_bg = time.time()
-from q6bit import recover_from_quant
-res_lst = recover_from_quant(res_lst)
-cal_hash_time = time.time()
-res_lst.sort(key=lambda x: x[0])
-hash_char = calculate_sha256(''.join([namei+str(parami.flatten()[7].item()) for namei, parami in res_lst]))
-dequant_ed = time.time()
-print(f"dequant cost {dequant_ed - dequant_bg:.4f} s\n"
-        f"cal hash cost {dequant_ed - cal_hash_time:.4f} s\tsha256: {hash_char}")
-if hash_char != '6d46f62caef0d415ade2ba0f5d1f1178af39332fba692008c0846417c66550bb':
-    print(f"WARNING: hash is not correct, please check")
+from q6bit import recover_from_quant, quantize_to_6bit
+from q6bit.cfunc import split_name
+from q6bit._C import calculate_dequant, dequant_kernels, get_dequant_kernel, set_dequant_kernel
+
+# sha256 of the sampled weights of /lustre/share/xflops/amazing_llm/qwen3-8b-m3/
+REAL_SHA256 = '6d46f62caef0d415ade2ba0f5d1f1178af39332fba692008c0846417c66550bb'
+
+# Qwen3-8B: hidden 4096, intermediate 12288, 8 kv heads of 128
+HIDDEN, VOCAB = 4096, 151936
+LAYER_SHAPES = {
+    "self_attn.q_proj": (4096, 4096), "self_attn.k_proj": (1024, 4096), "self_attn.v_proj": (1024, 4096),
+    "self_attn.o_proj": (4096, 4096), "mlp.gate_proj": (12288, 4096), "mlp.up_proj": (12288, 4096),
+    "mlp.down_proj": (4096, 12288),
+}
+# rows quantized at a time, to bound the float copy quantize_to_6bit makes
+QUANT_ROWS = 4096
+
+def quantized(shape: tuple[int, int], group_size: int, gen: torch.Generator) -> list[torch.Tensor]:
+    chunks = [quantize_to_6bit(torch.randn((min(QUANT_ROWS, shape[0] - r), shape[1]), generator=gen).mul_(0.02),
+                               group_size) for r in range(0, shape[0], QUANT_ROWS)]
+    return [torch.cat(parts) for parts in zip(*chunks)]
+
+def synthetic_checkpoint(layers: int, vocab: int, group_size: int, seed: int) -> list[tuple[str, torch.Tensor]]:
+    '''random weights of the first `layers` layers of Qwen3-8B, quantized as the real checkpoint'''
+    gen = torch.Generator().manual_seed(seed)
+    shapes = {"model.embed_tokens": (vocab, HIDDEN), "lm_head": (vocab, HIDDEN)} if vocab else {}
+    for i in range(layers):
+        shapes.update({f"model.layers.{i}.{ki}": si for ki, si in LAYER_SHAPES.items()})
+    qweight_lst = []
+    for namei, shapei in shapes.items():
+        qweight, zero_point, scales = quantized(shapei, group_size, gen)
+        qweight_lst += [(f"{namei}.weight.qweight", qweight), (f"{namei}.weight.zero_point", zero_point),
+                        (f"{namei}.weight.scales", scales)]
+    for i in range(layers):
+        for normi in ("input_layernorm", "post_attention_layernorm"):
+            qweight_lst.append((f"model.layers.{i}.{normi}.weight", torch.ones(HIDDEN, dtype=torch.half)))
+    qweight_lst.append(("model.norm.weight", torch.ones(HIDDEN, dtype=torch.half)))
+    return qweight_lst
+
+def real_checkpoint(path: str) -> list[tuple[str, torch.Tensor]]:
+    from safetensors import safe_open
+    qweight_lst = []
+    for st_file in sorted(os.path.join(path, i) for i in os.listdir(path) if i.endswith('.safetensors')):
+        with safe_open(st_file, framework="pt") as f:
+            qweight_lst.extend([(namei, f.get_tensor(namei).detach().clone()) for namei in f.keys()])
+    return qweight_lst
+
+def saved_checkpoint(qweight_lst: list[tuple[str, torch.Tensor]], path: str) -> str:
+    '''`qweight_lst` written to `path` as a one-file safetensors checkpoint; returns `path`'''
+    from safetensors.torch import save_file
+    save_file({namei: ti.contiguous() for namei, ti in qweight_lst}, os.path.join(path, "model.safetensors"))
+    return path
+
+def triples(qweight_lst: list[tuple[str, torch.Tensor]]) -> dict[str, tuple[torch.Tensor, ...]]:
+    '''(qweight, zero_point, scales) of each weight'''
+    parts: dict[str, dict[str, torch.Tensor]] = {}
+    for namei, ti in qweight_lst:
+        key = split_name(namei)
+        if key is not None:
+            parts.setdefault(key[0], {})[key[1]] = ti
+    return {ki: (pi["qweight"], pi["zero_point"], pi["scales"]) for ki, pi in parts.items()}
+
+def dequant_bytes(qweight: torch.Tensor) -> int:
+    '''packed bytes read plus fp16 bytes written'''
+    return qweight.numel() + qweight.numel() // 3 * 4 * 2
+
+def sampled_sha256(res_lst: list[tuple[str, torch.Tensor]]) -> str:
+    res_lst = sorted(res_lst, key=lambda x: x[0])
+    return hashlib.sha256(''.join([namei+str(parami.flatten()[7].item()) for namei, parami in res_lst]).encode()).hexdigest()
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def bench_cold(checkpoint: str) -> dict:
+    '''
+    the cold run, in this process: load `checkpoint` without any parallel op (no copies), then
+    time recover_from_quant, the first op to start torch's threads
+    '''
+    from safetensors.torch import load_file
+    qweight_lst = []
+    for st_file in sorted(os.path.join(checkpoint, i) for i in os.listdir(checkpoint) if i.endswith('.safetensors')):
+        qweight_lst.extend(load_file(st_file).items())
+    start = time.perf_counter()
+    res_lst = recover_from_quant(qweight_lst)
+    return {"cold": time.perf_counter() - start, "sha256": sampled_sha256(res_lst)}
+
+def cold_run(checkpoint: str, bind: Optional[str]) -> dict:
+    '''`bench_cold` in a fresh process, bound as this one'''
+    cmd = [sys.executable, os.path.abspath(__file__), "--cold", checkpoint] + (["--bind", bind] if bind else [])
+    res = subprocess.run(cmd, stdout=subprocess.PIPE, text=True, check=True)
+    return json.loads(res.stdout.splitlines()[-1])
+
+def bench_recover(qweight_lst: list[tuple[str, torch.Tensor]], checkpoint: str, bind: Optional[str],
+                  repeat: int) -> dict:
+    '''warm runs here, the cold run of `checkpoint` (the same weights, saved) in a fresh process'''
+    cold_res = cold_run(checkpoint, bind)
+    cold = cold_res["cold"]
+    warm, res_lst = [], recover_from_quant(qweight_lst)
+    for _ in range(repeat):
+        # free the previous results first, as a restarted server would not have them
+        res_lst = None
+        start = time.perf_counter()
+        res_lst = recover_from_quant(qweight_lst)
+        warm.append(time.perf_counter() - start)
+    t_avg = sum(warm) / len(warm)
+    limit = max(1.5 * t_avg, t_avg + 1.5)
+    nbytes = sum(dequant_bytes(qi) for qi, _, _ in triples(qweight_lst).values())
+    return {"kernel": get_dequant_kernel(), "threads": torch.get_num_threads(),
+            "cold": cold, "warm": warm, "t_avg": t_avg, "cold_minus_warm": cold - t_avg,
+            "cold_limit": limit, "cold_ok": cold <= limit, "gbps": nbytes / t_avg / 1e9,
+            "sha256": sampled_sha256(res_lst), "cold_sha256_ok": cold_res["sha256"] == sampled_sha256(res_lst)}
+
+def bench_kernels(qweight_lst: list[tuple[str, torch.Tensor]], threads: list[int], repeat: int) -> list[dict]:
+    '''best of `repeat` calculate_dequant per weight shape, kernel and thread count'''
+    shapes = {}
+    for qi, zi, si in triples(qweight_lst).values():
+        shapes.setdefault(tuple(qi.shape), (qi, zi, si))
+    default, default_threads = get_dequant_kernel(), torch.get_num_threads()
+    runs = []
+    try:
+        for kernel in dequant_kernels():
+            set_dequant_kernel(kernel)
+            for t in threads:
+                torch.set_num_threads(t)
+                for shape, case in shapes.items():
+                    calculate_dequant(*case)
+                    best = min(timed(lambda: calculate_dequant(*case)) for _ in range(repeat))
+                    runs.append({"kernel": kernel, "threads": t, "shape": list(shape),
+                                 "seconds": best, "gbps": dequant_bytes(case[0]) / best / 1e9})
+    finally:
+        set_dequant_kernel(default)
+        torch.set_num_threads(default_threads)
+    return runs
+
+def commit() -> Optional[str]:
+    res = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                         capture_output=True, text=True)
+    return res.stdout.strip() if res.returncode == 0 else None
+
+def cli():
+    parser = argparse.ArgumentParser(description="benchmark the q6bit dequant")
+    parser.add_argument("-o", "--output", default="speed_test.json", help="where to write the JSON report")
+    parser.add_argument("--checkpoint", help="safetensors checkpoint directory instead of a synthetic one")
+    parser.add_argument("--layers", type=int, default=4, help="layers of the synthetic checkpoint")
+    parser.add_argument("--vocab", type=int, default=VOCAB, help="embedding rows of the synthetic checkpoint, 0 for none")
+    parser.add_argument("--group-size", type=int, default=128)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bind", help="cores to bind the threads to as vllm does, e.g. 0-31")
+    parser.add_argument("--threads", help="thread counts of the kernel sweep, e.g. 1,16,32 (default 1, half, all)")
+    parser.add_argument("--repeat", type=int, default=3, help="warm runs (and kernel timings to take the best of)")
+    parser.add_argument("--cold", metavar="DIR", help=argparse.SUPPRESS)  # the cold run's process, see cold_run
+    args = parser.parse_args()
+
+    if args.bind:
+        from vllm.v1.worker.gpu_worker import init_worker_distributed_environment
+        ret = torch.ops._C_utils.init_cpu_threads_env(args.bind)
+        if ret:
+            print(ret)
+    if args.cold:
+        print(json.dumps(bench_cold(args.cold)))
+        return
+    n = torch.get_num_threads()
+    threads = [int(t) for t in args.threads.split(",")] if args.threads else sorted({1, max(1, n // 2), n})
+
+    load_start = time.perf_counter()
+    if args.checkpoint:
+        qweight_lst = real_checkpoint(args.checkpoint)
+    else:
+        qweight_lst = synthetic_checkpoint(args.layers, args.vocab, args.group_size, args.seed)
+    load = time.perf_counter() - load_start
+
+    if args.checkpoint:
+        recover = bench_recover(qweight_lst, args.checkpoint, args.bind, args.repeat)
+    else:
+        with tempfile.TemporaryDirectory(prefix="q6bit-speed-") as tmp:
+            recover = bench_recover(qweight_lst, saved_checkpoint(qweight_lst, tmp), args.bind, args.repeat)
+    print(f"recover_from_quant ({recover['kernel']}, {recover['threads']} threads): cold {recover['cold']:.4f} s, "
+          f"t_avg {recover['t_avg']:.4f} s, {recover['gbps']:.2f} GB/s")
+    print(f"cold start {'ok' if recover['cold_ok'] else 'TOO LONG'} (limit {recover['cold_limit']:.4f} s)")
+    if not recover["cold_sha256_ok"]:
+        print("WARNING: the cold run recovered different weights")
+    if args.checkpoint and recover["sha256"] != REAL_SHA256:
+        print("WARNING: hash is not correct, please check")
+
+    kernels = bench_kernels(qweight_lst, threads, args.repeat)
+    for run in kernels:
+        print(f"{run['kernel']:>7} {run['threads']:>3} threads {str(tuple(run['shape'])):>18}: {run['gbps']:.2f} GB/s")
+
+    report = {
+        "commit": commit(),
+        "torch": torch.__version__,
+        "checkpoint": args.checkpoint or {"synthetic": {"layers": args.layers, "vocab": args.vocab,
+                                                        "group_size": args.group_size, "seed": args.seed}},
+        "load": load,
+        "recover": recover,
+        "kernels": kernels,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    sys.exit(0 if recover["cold_ok"] else 1)
+
+if __name__ == "__main__":
+    cli()
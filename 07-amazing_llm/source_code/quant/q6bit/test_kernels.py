@@ -0,0 +1,59 @@
+'''
+bit-exact check of every dequant kernel this CPU supports against the PyTorch
+reference in utils.py, and of gemv_6bit against a float matmul
+
+    python -m q6bit.test_kernels
+'''
+import torch
+from . import utils
+from ._C import (calculate_dequant, calculate_dequant_batch, unsqueeze_from_6bit, gemv_6bit,
+                 dequant_kernels, get_dequant_kernel, set_dequant_kernel)
+
+def random_quant(shape: tuple[int, ...], group_size: int, gen: torch.Generator):
+    '''qweight [*shape, group_size//4*3], zero_point/scales [*shape, 1], as in the checkpoint'''
+    qweight = torch.randint(0, 256, (*shape, group_size // 4 * 3), dtype=torch.uint8, generator=gen)
+    zero_point = torch.randint(-128, 128, (*shape, 1), dtype=torch.int8, generator=gen)
+    # normal, subnormal and large scales
+    scales = (torch.randn((*shape, 1), generator=gen) *
+              torch.tensor([1e-7, 1e-3, 1.0, 300.0])[torch.randint(0, 4, (*shape, 1), generator=gen)]).half()
+    return qweight, zero_point, scales
+
+def same_bits(a: torch.Tensor, b: torch.Tensor) -> bool:
+    return a.shape == b.shape and a.dtype == b.dtype and torch.equal(a.view(torch.int16), b.view(torch.int16))
+
+CASES = [((4096, 32), 128), ((16, 7), 12), ((3, 5, 9), 20), ((33,), 32), ((2, 1), 4), ((8, 3), 256)]
+# (x rows, N, K // group_size, group_size)
+GEMV_CASES = [(1, 512, 32, 128), (3, 17, 7, 12), (8, 5, 3, 256), (1, 1, 1, 4)]
+
+def check_gemv(kernel: str, gen: torch.Generator):
+    for m, n, groups, group_size in GEMV_CASES:
+        qweight, zero_point, _ = random_quant((n, groups), group_size, gen)
+        scales = (torch.randn((n, groups, 1), generator=gen) * 1e-2).half()
+        x = torch.randn((m, groups * group_size), generator=gen)
+        want = x @ utils.calculate_dequant(qweight, zero_point, scales).float().T
+        got = gemv_6bit(x, qweight, zero_point, scales)
+        assert torch.allclose(got, want, rtol=1e-4, atol=1e-4 * want.abs().max().item()), f"{kernel}: gemv {n}x{groups}"
+        assert gemv_6bit(x.half(), qweight, zero_point, scales).dtype == torch.half
+
+def main():
+    gen = torch.Generator().manual_seed(0)
+    cases = [random_quant(shape, group_size, gen) for shape, group_size in CASES]
+    expected = [utils.calculate_dequant(*case) for case in cases]
+    for qweight, _, _ in cases:
+        assert torch.equal(unsqueeze_from_6bit(qweight), utils.unsqueeze_from_6bit(qweight))
+
+    default = get_dequant_kernel()
+    try:
+        for kernel in dequant_kernels():
+            set_dequant_kernel(kernel)
+            for case, want in zip(cases, expected):
+                assert same_bits(calculate_dequant(*case), want), f"{kernel}: {case[0].shape}"
+            batch = calculate_dequant_batch(*map(list, zip(*cases)))
+            assert all(same_bits(got, want) for got, want in zip(batch, expected)), f"{kernel}: batch"
+            check_gemv(kernel, gen)
+            print(f"{kernel}: ok")
+    finally:
+        set_dequant_kernel(default)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+'''
+round trip of quantize_to_6bit through the dequant, native and PyTorch reference
+
+    python -m q6bit.test_quantize
+'''
+import torch
+from . import utils
+from ._C import calculate_dequant, quantize_to_6bit
+
+# (weight shape, group_size)
+CASES = [((4096, 4096), 128), ((16, 84), 12), ((3, 5, 180), 20), ((7, 256), 256), ((1, 4), 4)]
+
+def check(weight: torch.Tensor, group_size: int):
+    qweight, zero_point, scales = quantize_to_6bit(weight, group_size)
+    groups = weight.shape[-1] // group_size
+    assert qweight.shape == (*weight.shape[:-1], groups, group_size // 4 * 3) and qweight.dtype == torch.uint8
+    assert zero_point.shape == scales.shape == (*weight.shape[:-1], groups, 1)
+    assert zero_point.dtype == torch.int8 and scales.dtype == torch.float16
+    assert int(utils.unsqueeze_from_6bit(qweight).max()) <= 63 and 0 <= int(zero_point.min()) <= int(zero_point.max()) <= 63
+
+    # the layout is the one the reference unpacks, bit for bit
+    got = calculate_dequant(qweight, zero_point, scales)
+    want = utils.calculate_dequant(qweight, zero_point, scales)
+    assert torch.equal(got.view(torch.int16), want.view(torch.int16)), f"{tuple(weight.shape)}: layout"
+
+    # every value within half a step of the weight, plus the clamp at 63 when the fp16 scale
+    # rounded down and the fp16 rounding of the result
+    w = weight.float().reshape(*weight.shape[:-1], groups, group_size)
+    err = (got.float().reshape(w.shape) - w).abs()
+    assert bool((err <= scales.float() * 0.6 + w.abs() * 1e-3).all()), f"{tuple(weight.shape)}: error {err.max().item()}"
+
+def main():
+    gen = torch.Generator().manual_seed(0)
+    for shape, group_size in CASES:
+        check(torch.randn(shape, generator=gen).half() * 0.05, group_size)
+    # all-positive, all-zero and constant groups
+    check(torch.rand((8, 64), generator=gen).half() + 1, 16)
+    check(torch.zeros((4, 32), dtype=torch.half), 8)
+    check(torch.full((4, 32), -3.0, dtype=torch.half), 8)
+    print("ok")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+'''
+recover_from_quant_iter against the eager recover_from_quant, and the overlap of its
+batches: each batch starts dequantizing before the one before it is handed out
+
+    python -m q6bit.test_stream
+'''
+import threading
+import torch
+from . import cfunc
+from .test_kernels import random_quant, same_bits
+
+# (rows, groups, group_size) of each weight
+SHAPES = [(64, 8, 128), (33, 5, 20), (16, 4, 256), (7, 3, 12), (128, 2, 128)]
+# how long a batch may take to start once it could
+START_TIMEOUT = 5.0
+
+def checkpoint(gen: torch.Generator) -> list[tuple[str, torch.Tensor]]:
+    qweight_lst = []
+    for i, (rows, groups, group_size) in enumerate(SHAPES):
+        qweight, zero_point, scales = random_quant((rows, groups), group_size, gen)
+        qweight_lst += [(f"layers.{i}.weight.qweight", qweight), (f"layers.{i}.weight.zero_point", zero_point),
+                        (f"layers.{i}.weight.scales", scales)]
+        qweight_lst.append((f"layers.{i}.norm.weight", torch.ones(rows * groups, dtype=torch.half)))
+    return qweight_lst
+
+def check_overlap(qweight_lst: list[tuple[str, torch.Tensor]], expected: dict[str, torch.Tensor]):
+    '''one weight per batch: the results of batch i come out while batch i+1 is already running'''
+    started = [threading.Event() for _ in SHAPES]
+    batch_of = {f"layers.{i}.weight": i for i in range(len(SHAPES))}
+    dequant_batch = cfunc.c_dequant_batch
+    def recording(qweight_dic_lst):
+        started[batch_of[qweight_dic_lst[0][0]]].set()
+        return dequant_batch(qweight_dic_lst)
+
+    cfunc.c_dequant_batch = recording
+    try:
+        seen = set()
+        for namei, ti in cfunc.c_recover_from_quant_iter(qweight_lst, batch_numel=1):
+            assert same_bits(ti, expected[namei]), namei
+            seen.add(namei)
+            i = batch_of.get(namei)
+            if i is not None and i + 1 < len(SHAPES):
+                assert started[i+1].wait(START_TIMEOUT), f"batch {i+1} did not start before batch {i} was yielded"
+        assert seen == expected.keys()
+    finally:
+        cfunc.c_dequant_batch = dequant_batch
+
+def main():
+    gen = torch.Generator().manual_seed(0)
+    qweight_lst = checkpoint(gen)
+    expected = dict(cfunc.c_recover(qweight_lst))
+
+    for batch_numel in (1, 1 << 12, 1 << 26):
+        got = dict(cfunc.c_recover_from_quant_iter(qweight_lst, batch_numel))
+        assert got.keys() == expected.keys() and all(same_bits(got[k], expected[k]) for k in got), batch_numel
+    try:
+        list(cfunc.c_recover_from_quant_iter(qweight_lst[:-2]))
+        raise AssertionError("incomplete weights accepted")
+    except KeyError:
+        pass
+    check_overlap(qweight_lst, expected)
+    print("recover_from_quant_iter: ok")
+
+if __name__ == "__main__":
+    main()